@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Офлайн-бенчмарк цепочки получение -> фильтрация -> состояние.
+
+Все обращения к API идут в fake_vk_server.FakeVkApi, паузы time.sleep
+отключаются. Результаты пишутся в JSON, чтобы сравнивать версии:
+
+    python benchmark.py --output bench_new.json --compare bench_old.json
+    python benchmark.py --sizes 1000,100000 --history 10000,100000
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+from fake_vk_server import FakeVkApi, FakeVkServer, generate_members
+from vk_transport import VkHttpSession
+
+BASE_ENV = {
+    "VK_ACCESS_TOKEN": "benchmark",
+    "TARGET_GROUP_ID": "1",
+    "YOUR_GROUP_ID": "2",
+    "MAX_INVITES_PER_DAY": "20",
+    "MIN_DELAY": "0",
+    "MAX_DELAY": "0",
+    "FILTER_AGE_ENABLED": "True",
+    "FILTER_AGE_MIN": "18",
+    "FILTER_AGE_MAX": "50",
+    "FILTER_PHOTO_ENABLED": "True",
+    "FILTER_LAST_SEEN_ENABLED": "True",
+    "FILTER_LAST_SEEN_DAYS": "30",
+}
+
+
+class LocalVkApi:
+    """Обращение к FakeVkApi без HTTP: vk.groups.isMember(...) и т.п."""
+
+    def __init__(self, api, method=None):
+        self._api = api
+        self._method = method
+
+    def __getattr__(self, name):
+        return LocalVkApi(self._api, f"{self._method}.{name}" if self._method else name)
+
+    def __call__(self, **params):
+        response = self._api.call(self._method, {key: str(value) for key, value in params.items()})
+        if "error" in response:
+            raise Exception(f"[{response['error']['error_code']}] {response['error']['error_msg']}")
+        return response["response"]
+
+
+def measure(func, repeat, setup=None):
+    """Время выполнения func: минимум и медиана по repeat запускам.
+
+    Если задан setup, перед каждым запуском (вне замера) вызывается
+    setup(), и func получает его результат.
+    """
+    timings = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings), "repeat": repeat}
+
+
+def make_bot(workdir, session=None, **env):
+    """Бот с состоянием в workdir, без обращений к сети при создании"""
+    import vk_bot
+
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    with mock.patch.dict(os.environ, dict(BASE_ENV, MEMBERS_CACHE_DIR=os.path.join(workdir, "members_cache"), **env)):
+        return vk_bot.VKInviteBot(session=session)
+
+
+def bench_filter(sizes, repeat):
+    results = []
+    for size in sizes:
+        members = generate_members(size, seed=size)
+        api = FakeVkApi(members=members, our_members=[user["id"] for user in members[::10]])
+        with tempfile.TemporaryDirectory() as workdir:
+            runs = iter(range(repeat))
+
+            # filter_users записывает результаты проверки участия, поэтому
+            # каждый запуск начинается с пустого состояния
+            def setup():
+                bot = make_bot(os.path.join(workdir, str(next(runs))))
+                bot.vk = LocalVkApi(api)
+                return bot
+
+            timing = measure(lambda bot: bot.filter_users(members), repeat, setup)
+        results.append(dict(name="filter_users", size=size, **timing))
+        print(f"filter_users size={size}: {timing['min']:.4f} с")
+    return results
+
+
+def bench_state(history_sizes, repeat):
+    results = []
+    for backend in ("json", "sqlite"):
+        for size in history_sizes:
+            with tempfile.TemporaryDirectory() as workdir:
+                bot = make_bot(workdir, STATE_BACKEND="json")
+                bot.update_stats(users={"processed_users": range(1, size * 7, 7)})
+                bot.save_stats()
+
+                if backend == "sqlite":
+                    # Первая загрузка импортирует stats.json в базу
+                    migrate = measure(lambda: make_bot(workdir, STATE_BACKEND="sqlite"), 1)
+                    results.append(dict(name="sqlite_migrate", backend=backend, size=size, **migrate))
+                bot = make_bot(workdir, STATE_BACKEND=backend)
+
+                load = measure(bot.load_stats, repeat)
+                save = measure(bot.save_stats, repeat)
+                counter = iter(range(size * 7 + 1, size * 100, 7))
+                update = measure(
+                    lambda: bot.update_stats({"invites_today": 1}, {"processed_users": [next(counter)]}),
+                    repeat
+                )
+                lookup = measure(lambda: [user_id in bot.stats["processed_users"] for user_id in range(1000)], repeat)
+
+            for name, timing in (("load_stats", load), ("save_stats", save),
+                                 ("update_stats", update), ("lookup_1000", lookup)):
+                results.append(dict(name=name, backend=backend, size=size, **timing))
+            print(f"state backend={backend} history={size}: load {load['min']:.4f} с, "
+                  f"save {save['min']:.4f} с, update {update['min']:.5f} с")
+    return results
+
+
+def bench_run(members_count, repeat, use_execute):
+    import vk_bot
+    from metrics import Metrics
+
+    members = generate_members(members_count, seed=1)
+    servers = []
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = iter(range(repeat))
+
+        # Кэш ID групп и метрики модуля vk_bot общие для всех ботов процесса,
+        # поэтому каждый запуск начинается с пустого кэша, нового сервера
+        # и пустого состояния
+        def setup():
+            vk_bot._group_id_cache.clear()
+            vk_bot._metrics = Metrics()
+            api = FakeVkApi(groups={"target": 1, "ours": 2}, members=members,
+                            our_members=[user["id"] for user in members[::10]])
+            servers.append(FakeVkServer(api).start())
+            return make_bot(os.path.join(workdir, str(next(runs))),
+                            session=VkHttpSession(base_url=servers[-1].api_url),
+                            TARGET_GROUP_ID="target", YOUR_GROUP_ID="ours",
+                            USE_EXECUTE=str(use_execute))
+
+        try:
+            timing = measure(lambda bot: bot.run(), repeat, setup)
+        finally:
+            for server in servers:
+                server.stop()
+
+    # Все запуски выполняют одинаковую работу; вызовы API - последнего из них
+    api = servers[-1].api
+    print(f"run members={members_count} execute={use_execute}: {timing['min']:.3f} с, "
+          f"вызовы API: {dict(api.calls)}")
+    return [dict(name="run", size=members_count, use_execute=use_execute,
+                 api_calls=dict(api.calls), invites=len(api.invited), **timing)]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def result_key(result):
+    return tuple(
+        (key, result[key]) for key in ("name", "size", "backend", "use_execute") if key in result
+    )
+
+
+def compare(results, baseline_file):
+    """Вывод отношения времени к результатам из baseline_file"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {result_key(result): result for result in json.load(f)["results"]}
+    print(f"\nСравнение с {baseline_file}:")
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old and old["min"]:
+            ratio = result["min"] / old["min"]
+            label = ", ".join(f"{key}={value}" for key, value in result_key(result))
+            print(f"  {label}: {old['min']:.4f} -> {result['min']:.4f} с (x{ratio:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк VK бота")
+    parser.add_argument("--sizes", default="1000,100000,1000000",
+                        help="размеры страниц участников для filter_users")
+    parser.add_argument("--history", default="1000,100000,1000000",
+                        help="размеры истории обработанных пользователей")
+    parser.add_argument("--run-members", type=int, default=10000,
+                        help="количество участников целевой группы для run()")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON с результатами предыдущей версии")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    history = [int(size) for size in args.history.split(",") if size]
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    import vk_bot
+    # Логи бота в бенчмарке не нужны
+    logging.disable(logging.CRITICAL)
+
+    results = []
+    try:
+        with mock.patch.object(time, "sleep", lambda seconds: None):
+            results += bench_filter(sizes, args.repeat)
+            results += bench_state(history, args.repeat)
+            results += bench_run(args.run_members, args.repeat, use_execute=False)
+            results += bench_run(args.run_members, args.repeat, use_execute=True)
+    finally:
+        os.chdir(cwd)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты сохранены в {output}")
+
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Локальный сервер, имитирующий VK API для офлайн-запуска бота.
+
+Поддерживаются методы groups.getById, groups.getMembers, groups.isMember,
+groups.invite, users.get и execute (в том виде, в котором его вызывает бот), а также
+заранее заданные ошибки. Пример запуска:
+
+    python fake_vk_server.py --port 8080 --members 5000
+    VK_API_URL=http://127.0.0.1:8080/method/ python vk_bot.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Доли участников с отсутствующими полями профиля
+MISSING_BDATE_SHARE = 0.45
+PARTIAL_BDATE_SHARE = 0.25
+MISSING_CITY_SHARE = 0.35
+MISSING_LAST_SEEN_SHARE = 0.05
+
+API_CALL_RE = re.compile(r"API\.([\w.]+)\(")
+
+
+def generate_members(count, seed=0, first_id=1):
+    """Синтетические участники группы с полями sex, bdate, city,
+    last_seen и has_photo"""
+    rnd = random.Random(seed)
+    now = int(time.time())
+    members = []
+    user_id = first_id
+    for _ in range(count):
+        user_id += rnd.randint(1, 50)
+        user = {
+            "id": user_id,
+            "first_name": "User",
+            "last_name": str(user_id),
+            "sex": rnd.choice((0, 1, 2, 2, 1)),
+            "has_photo": 1 if rnd.random() < 0.8 else 0
+        }
+        share = rnd.random()
+        if share >= MISSING_BDATE_SHARE:
+            day, month = rnd.randint(1, 28), rnd.randint(1, 12)
+            if share < MISSING_BDATE_SHARE + PARTIAL_BDATE_SHARE:
+                user["bdate"] = f"{day}.{month}"
+            else:
+                user["bdate"] = f"{day}.{month}.{rnd.randint(1955, 2012)}"
+        if rnd.random() >= MISSING_CITY_SHARE:
+            user["city"] = {"id": rnd.choice((1, 1, 2, 3, 99)), "title": "City"}
+        if rnd.random() >= MISSING_LAST_SEEN_SHARE:
+            # Большинство заходили недавно, часть - давно
+            days = rnd.expovariate(1 / 20.0)
+            user["last_seen"] = {"time": now - int(days * 86400), "platform": 7}
+        members.append(user)
+    return members
+
+
+class VkApiError(Exception):
+    def __init__(self, code, message, **extra):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.extra = extra
+
+    def to_dict(self, method, params):
+        error = {
+            "error_code": self.code,
+            "error_msg": self.message,
+            "request_params": [{"key": "method", "value": method}] + [
+                {"key": key, "value": str(value)} for key, value in params.items()
+            ]
+        }
+        error.update(self.extra)
+        return error
+
+
+class HttpError(Exception):
+    """Ответ сервера с HTTP-ошибкой вместо JSON"""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class FakeVkApi:
+    """Состояние и логика методов фиктивного VK API.
+
+    groups - словарь {короткое имя: ID}; members - участники целевой
+    группы; our_members - ID уже состоящих в нашей группе; errors -
+    список сценариев ошибок вида
+    {"method": "groups.invite", "error_code": 15, "error_msg": "...",
+     "user_id": 123, "params": {"offset": 1000}, "times": 1}
+    (user_id, params и times необязательны). Вместо error_code можно
+    указать http_status - тогда сервер ответит HTTP-ошибкой, например 502.
+    """
+
+    def __init__(self, groups=None, members=(), our_members=(), errors=()):
+        self.groups = dict(groups or {"target": 1, "ours": 2})
+        self.members = list(members)
+        self.members_by_id = None
+        self.our_members = set(our_members)
+        self.errors = [dict(error) for error in errors]
+        self.invited = []
+        self.calls = Counter()
+        # Все вызовы методов с параметрами: [(метод, параметры), ...]
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def call(self, method, params):
+        """Вызов метода; возвращает тело ответа в формате VK"""
+        try:
+            return {"response": self.dispatch(method, params)}
+        except VkApiError as e:
+            return {"error": e.to_dict(method, params)}
+
+    def dispatch(self, method, params):
+        with self.lock:
+            self.calls[method] += 1
+            self.requests.append((method, dict(params)))
+            self.raise_scripted_error(method, params)
+
+        if method == "execute":
+            return self.execute(params.get("code", ""))
+
+        handler = {
+            "groups.getById": self.groups_get_by_id,
+            "groups.getMembers": self.groups_get_members,
+            "groups.isMember": self.groups_is_member,
+            "groups.invite": self.groups_invite,
+            "users.get": self.users_get
+        }.get(method)
+        if handler is None:
+            raise VkApiError(3, "Unknown method passed")
+        return handler(params)
+
+    def raise_scripted_error(self, method, params):
+        for error in self.errors:
+            if error.get("method") != method:
+                continue
+            if "user_id" in error and str(error["user_id"]) != str(params.get("user_id")):
+                continue
+            if any(str(params.get(key)) != str(value) for key, value in error.get("params", {}).items()):
+                continue
+            if error.get("times") is not None:
+                if error["times"] <= 0:
+                    continue
+                error["times"] -= 1
+
+            if "http_status" in error:
+                raise HttpError(error["http_status"])
+            extra = {}
+            if error["error_code"] == 14:
+                extra = {"captcha_sid": "1", "captcha_img": "http://127.0.0.1/captcha.jpg"}
+            raise VkApiError(error["error_code"], error.get("error_msg", "Scripted error"), **extra)
+
+    def resolve_group(self, value):
+        value = str(value)
+        if value.isdigit():
+            return int(value)
+        if value in self.groups:
+            return self.groups[value]
+        raise VkApiError(100, "One of the parameters specified was missing or invalid: group_id is undefined")
+
+    def groups_get_by_id(self, params):
+        identifiers = str(params.get("group_ids") or params.get("group_id", "")).split(",")
+        return [
+            {"id": self.resolve_group(identifier), "screen_name": identifier, "name": identifier}
+            for identifier in identifiers if identifier
+        ]
+
+    @staticmethod
+    def select_fields(user, fields):
+        return {
+            key: value for key, value in user.items()
+            if key in ("id", "first_name", "last_name") or key in fields
+        }
+
+    def groups_get_members(self, params):
+        self.resolve_group(params.get("group_id"))
+        offset = int(params.get("offset", 0))
+        count = min(int(params.get("count", 1000)), 1000)
+        page = self.members[offset:offset + count]
+
+        fields = [field for field in str(params.get("fields", "")).split(",") if field]
+        if fields:
+            items = [self.select_fields(user, fields) for user in page]
+        else:
+            items = [user["id"] for user in page]
+        return {"count": len(self.members), "items": items}
+
+    def users_get(self, params):
+        if self.members_by_id is None:
+            self.members_by_id = {user["id"]: user for user in self.members}
+        fields = [field for field in str(params.get("fields", "")).split(",") if field]
+        return [
+            self.select_fields(self.members_by_id.get(int(user_id), {"id": int(user_id)}), fields)
+            for user_id in str(params.get("user_ids", "")).split(",") if user_id
+        ]
+
+    def groups_is_member(self, params):
+        self.resolve_group(params.get("group_id"))
+        if "user_ids" in params:
+            return [
+                {"user_id": int(user_id), "member": int(int(user_id) in self.our_members)}
+                for user_id in str(params["user_ids"]).split(",") if user_id
+            ]
+        return int(int(params.get("user_id")) in self.our_members)
+
+    def groups_invite(self, params):
+        self.resolve_group(params.get("group_id"))
+        user_id = int(params.get("user_id"))
+        with self.lock:
+            self.invited.append(user_id)
+        return 1
+
+    def execute(self, code):
+        """Выполнение кода вида return [API.method({...}), ...];"""
+        decoder = json.JSONDecoder()
+        results = []
+        position = 0
+        while True:
+            match = API_CALL_RE.search(code, position)
+            if not match:
+                break
+            params, end = decoder.raw_decode(code, match.end())
+            position = end + 1
+            if len(results) >= 25:
+                raise VkApiError(13, "Runtime error occurred during code invocation: too many API calls")
+            try:
+                results.append(self.dispatch(match.group(1), params))
+            except VkApiError:
+                results.append(False)
+        return results
+
+
+class FakeVkServer(ThreadingHTTPServer):
+    """HTTP-сервер поверх FakeVkApi; start() запускает его в фоновом потоке"""
+
+    daemon_threads = True
+
+    def __init__(self, api, host="127.0.0.1", port=0):
+        super().__init__((host, port), FakeVkHandler)
+        self.api = api
+        self.thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/method/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeVkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_method(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8")
+        params = parse_qs(urlparse(self.path).query)
+        params.update(parse_qs(body))
+        self.handle_method(params)
+
+    def handle_method(self, params):
+        path = urlparse(self.path).path
+        if not path.startswith("/method/"):
+            self.send_error(404)
+            return
+        method = path[len("/method/"):]
+        params = {key: values[-1] for key, values in params.items()}
+        params.pop("access_token", None)
+        params.pop("v", None)
+
+        try:
+            body = json.dumps(self.server.api.call(method, params), ensure_ascii=False).encode("utf-8")
+        except HttpError as e:
+            self.send_error(e.status)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный фиктивный VK API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--members", type=int, default=5000, help="количество участников целевой группы")
+    parser.add_argument("--our-share", type=float, default=0.1, help="доля уже состоящих в нашей группе")
+    parser.add_argument("--errors", help="JSON-файл со сценариями ошибок")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    members = generate_members(args.members, seed=args.seed)
+    rnd = random.Random(args.seed)
+    our_members = [user["id"] for user in members if rnd.random() < args.our_share]
+    errors = []
+    if args.errors:
+        with open(args.errors, 'r', encoding='utf-8') as f:
+            errors = json.load(f)
+
+    server = FakeVkServer(FakeVkApi(members=members, our_members=our_members, errors=errors),
+                          host=args.host, port=args.port)
+    print(f"Фиктивный VK API: {server.api_url} (группы: target=1, ours=2)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+# Логгер бота; компоненты - его дочерние логгеры (VK_Bot.state и т.п.)
+ROOT_LOGGER = "VK_Bot"
+
+# Формат строк текстового лога
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Размер файла лога для ротации по размеру, байты
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+# Количество сохраняемых сжатых архивов лога
+DEFAULT_BACKUP_COUNT = 5
+
+_listener = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Компактный формат: одна JSON-запись на строку"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+
+def gzip_namer(name):
+    return name + ".gz"
+
+
+def gzip_rotator(source, dest):
+    """Сжатие файла лога при ротации"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def parse_levels(value):
+    """Уровни компонентов из строки вида "state=WARNING,invite=DEBUG" """
+    levels = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        component, level = (part.strip() for part in item.split("=", 1))
+        if component and level:
+            levels[component] = level.upper()
+    return levels
+
+
+def create_file_handler(log_file, rotate):
+    """Файловый обработчик с ротацией по размеру (size) или по времени (time)"""
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", DEFAULT_BACKUP_COUNT))
+    if rotate == "time":
+        handler = TimedRotatingFileHandler(
+            log_file,
+            when=os.getenv("LOG_ROTATE_WHEN", "midnight"),
+            backupCount=backup_count,
+            encoding="utf-8"
+        )
+    else:
+        handler = RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            backupCount=backup_count,
+            encoding="utf-8"
+        )
+    handler.namer = gzip_namer
+    handler.rotator = gzip_rotator
+    return handler
+
+
+def setup_logging():
+    """Настройка логирования бота по переменным окружения.
+
+    Логгеры только помещают записи в очередь; запись в файл (с ротацией
+    и сжатием) и вывод в консоль выполняет QueueListener в отдельном
+    потоке. Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    log_file = os.getenv("LOG_FILE", "vk_bot.log")
+    if log_file:
+        handlers.append(create_file_handler(log_file, os.getenv("LOG_ROTATE", "size").lower()))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+
+    # Уровень задается для логгеров, поэтому отфильтрованные записи
+    # не попадают в очередь
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for component, level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(f"{ROOT_LOGGER}.{component}").setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+from datetime import date, datetime, timedelta
+from itertools import repeat
+
+# Значение для отсутствующих полей профиля
+MISSING = -(2 ** 63)
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Предел размера кэша разобранных дат рождения
+BIRTH_DAY_CACHE_SIZE = 100000
+
+
+# Формат DD.MM.YYYY с теми же допустимыми вариантами, что и у
+# datetime.strptime(bdate, "%d.%m.%Y")
+BDATE_RE = re.compile(r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)")
+
+
+def parse_birth_day(bdate):
+    """Дата рождения DD.MM.YYYY в виде номера дня от 1970-01-01.
+
+    Для неполной (без года) или некорректной даты возвращает MISSING -
+    фильтр по возрасту к такому пользователю не применяется.
+    """
+    try:
+        match = BDATE_RE.fullmatch(bdate)
+        if not match:
+            return MISSING
+        day, month, year = match.groups()
+        return date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+    except Exception:
+        return MISSING
+
+
+class BirthDayCache(dict):
+    """Кэш parse_birth_day по строке bdate.
+
+    Различных дат рождения намного меньше, чем участников, поэтому
+    каждая строка разбирается один раз за все время работы процесса.
+    """
+
+    def __missing__(self, bdate):
+        if len(self) >= BIRTH_DAY_CACHE_SIZE:
+            self.clear()
+        birth_day = self[bdate] = parse_birth_day(bdate)
+        return birth_day
+
+
+_birth_days = BirthDayCache()
+
+
+# Поля профиля VK, нужные столбцам MemberColumns
+COLUMN_FIELDS = {
+    "last_seen": "last_seen",
+    "sex": "sex",
+    "city_id": "city",
+    "has_photo": "has_photo",
+    "birth_day": "bdate",
+}
+
+
+def member_fields(filters):
+    """Поля профиля VK, нужные включенным фильтрам (в порядке COLUMN_FIELDS)"""
+    columns = required_columns(filters)
+    return [field for column, field in COLUMN_FIELDS.items() if column in columns]
+
+
+def required_columns(filters):
+    """Столбцы, нужные включенным фильтрам из config["filters"]"""
+    columns = set()
+    if filters["last_seen_days"]["enabled"]:
+        columns.add("last_seen")
+    if filters["sex"]["enabled"] and filters["sex"]["value"] != 0:
+        columns.add("sex")
+    if filters["city_id"]["enabled"]:
+        columns.add("city_id")
+    if filters["has_photo"]["enabled"]:
+        columns.add("has_photo")
+    if filters["age"]["enabled"]:
+        columns.add("birth_day")
+    return columns
+
+
+class MemberColumns:
+    """Страница участников группы в виде столбцов.
+
+    Поля профиля разбираются за один проход по странице, после чего все
+    фильтры работают со столбцами чисел. Отсутствующие поля хранятся
+    как MISSING.
+    """
+
+    __slots__ = ("ids", "sex", "city_id", "has_photo", "last_seen", "birth_day")
+
+    def __init__(self, users):
+        ids, sex, city_id, has_photo, last_seen, birth_day = [], [], [], [], [], []
+        birth_days = _birth_days
+
+        # Столбцы - списки: list.append заметно быстрее array.append
+        for user in users:
+            ids.append(user["id"])
+            sex.append(user.get("sex", MISSING))
+            city_id.append(user["city"]["id"] if "city" in user else MISSING)
+            has_photo.append(user.get("has_photo") == 1)
+            last_seen.append(user["last_seen"]["time"] if "last_seen" in user else MISSING)
+            birth_day.append(birth_days[user["bdate"]] if "bdate" in user else MISSING)
+
+        self.ids = ids
+        self.sex = sex
+        self.city_id = city_id
+        self.has_photo = has_photo
+        self.last_seen = last_seen
+        self.birth_day = birth_day
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def filter_mask(columns, filters, now=None):
+    """Маска подходящих пользователей по настройкам config["filters"].
+
+    Возвращает bytearray, где 1 - пользователь проходит все включенные
+    фильтры. Пороговые значения вычисляются один раз на страницу, все
+    фильтры проверяются одним выражением; вместо столбцов выключенных
+    фильтров подставляются значения, которые всегда проходят проверку.
+    """
+    now = now or datetime.now()
+    size = len(columns)
+
+    # Фильтр по последней активности: (now - last_seen).days > N
+    # равносильно last_seen <= now - (N + 1) дней
+    last_seen, cutoff = repeat(MISSING, size), 0
+    if filters["last_seen_days"]["enabled"]:
+        last_seen = columns.last_seen
+        cutoff = (now - timedelta(days=filters["last_seen_days"]["value"] + 1)).timestamp()
+
+    # Фильтр по полу
+    sex, sex_value = repeat(0, size), 0
+    if filters["sex"]["enabled"] and filters["sex"]["value"] != 0:
+        sex, sex_value = columns.sex, filters["sex"]["value"]
+
+    # Фильтр по городу; ID города отсутствующего поля (MISSING) не совпадает
+    # ни с одним настроенным городом
+    city_id, city_value = repeat(0, size), 0
+    if filters["city_id"]["enabled"]:
+        city_id, city_value = columns.city_id, filters["city_id"]["value"]
+
+    # Фильтр по наличию фото
+    has_photo = repeat(True, size)
+    if filters["has_photo"]["enabled"]:
+        has_photo = columns.has_photo
+
+    # Фильтр по возрасту: возраст (дни // 365) в диапазоне [min, max]
+    # равносилен min * 365 <= дни < (max + 1) * 365
+    birth_day, low, high = repeat(MISSING, size), 0, 0
+    today = now.toordinal() - EPOCH_ORDINAL
+    if filters["age"]["enabled"]:
+        birth_day = columns.birth_day
+        low = filters["age"]["min"] * 365
+        high = (filters["age"]["max"] + 1) * 365
+
+    return bytearray(
+        (seen == MISSING or seen > cutoff) and user_sex == sex_value and city == city_value
+        and photo and (birth == MISSING or low <= today - birth < high)
+        for seen, user_sex, city, photo, birth in zip(last_seen, sex, city_id, has_photo, birth_day)
+    )
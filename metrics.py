@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+from collections import defaultdict
+
+# Границы корзин гистограммы задержек API, секунды
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Пары (граница, накопленное количество), последняя граница - +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Счетчики вызовов API, ошибок, задержек и пауз бота.
+
+    Живет все время работы процесса; обновления защищены блокировкой,
+    так как метрики читаются HTTP-сервером из другого потока.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.api_calls = defaultdict(int)
+        self.api_errors = defaultdict(int)
+        self.api_latency = defaultdict(Histogram)
+        self.sleep_seconds = defaultdict(float)
+        self.sleep_count = defaultdict(int)
+        self.runs = 0
+        self.run_seconds = 0.0
+
+    def observe_api(self, method, seconds, error_code=None):
+        with self.lock:
+            self.api_calls[method] += 1
+            self.api_latency[method].observe(seconds)
+            if error_code is not None:
+                self.api_errors[(method, str(error_code))] += 1
+
+    def observe_sleep(self, reason, seconds):
+        with self.lock:
+            self.sleep_seconds[reason] += seconds
+            self.sleep_count[reason] += 1
+
+    def observe_run(self, seconds):
+        with self.lock:
+            self.runs += 1
+            self.run_seconds += seconds
+
+    def snapshot(self):
+        """Метрики в виде словаря для сохранения в файле состояния"""
+        with self.lock:
+            api_seconds = sum(histogram.sum for histogram in self.api_latency.values())
+            run_sleep_seconds = sum(
+                seconds for reason, seconds in self.sleep_seconds.items() if reason != "cycle_wait"
+            )
+            return {
+                "api": {
+                    method: {
+                        "calls": self.api_calls[method],
+                        "seconds": round(histogram.sum, 3),
+                        "buckets": {str(bound): count for bound, count in histogram.cumulative()}
+                    }
+                    for method, histogram in self.api_latency.items()
+                },
+                "api_errors": {
+                    f"{method}:{code}": count for (method, code), count in self.api_errors.items()
+                },
+                "sleep": {
+                    reason: {"count": self.sleep_count[reason], "seconds": round(seconds, 3)}
+                    for reason, seconds in self.sleep_seconds.items()
+                },
+                "runs": self.runs,
+                "run_seconds": round(self.run_seconds, 3),
+                # Время работы без ожидания API и пауз
+                "work_seconds": round(max(self.run_seconds - api_seconds - run_sleep_seconds, 0.0), 3)
+            }
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        with self.lock:
+            lines.append("# TYPE vk_api_calls_total counter")
+            for method, count in sorted(self.api_calls.items()):
+                lines.append(f'vk_api_calls_total{{method="{method}"}} {count}')
+
+            lines.append("# TYPE vk_api_errors_total counter")
+            for (method, code), count in sorted(self.api_errors.items()):
+                lines.append(f'vk_api_errors_total{{method="{method}",code="{code}"}} {count}')
+
+            lines.append("# TYPE vk_api_latency_seconds histogram")
+            for method, histogram in sorted(self.api_latency.items()):
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'vk_api_latency_seconds_bucket{{method="{method}",le="{le}"}} {count}')
+                lines.append(f'vk_api_latency_seconds_sum{{method="{method}"}} {histogram.sum:.6f}')
+                lines.append(f'vk_api_latency_seconds_count{{method="{method}"}} {histogram.count}')
+
+            lines.append("# TYPE vk_sleep_seconds_total counter")
+            for reason, seconds in sorted(self.sleep_seconds.items()):
+                lines.append(f'vk_sleep_seconds_total{{reason="{reason}"}} {seconds:.3f}')
+            lines.append("# TYPE vk_sleeps_total counter")
+            for reason, count in sorted(self.sleep_count.items()):
+                lines.append(f'vk_sleeps_total{{reason="{reason}"}} {count}')
+
+            lines.append("# TYPE vk_runs_total counter")
+            lines.append(f"vk_runs_total {self.runs}")
+            lines.append("# TYPE vk_run_seconds_total counter")
+            lines.append(f"vk_run_seconds_total {self.run_seconds:.3f}")
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedApi:
+    """Обертка над vk_api.VkApiMethod, замеряющая каждый вызов метода.
+
+    vk.groups.getMembers(...) вызывает исходный метод и записывает в
+    metrics время выполнения и код ошибки VK (или имя исключения).
+    """
+
+    __slots__ = ("_api", "_metrics", "_method")
+
+    def __init__(self, api, metrics, method=None):
+        self._api = api
+        self._metrics = metrics
+        self._method = method
+
+    def __getattr__(self, name):
+        method = f"{self._method}.{name}" if self._method else name
+        return InstrumentedApi(getattr(self._api, name), self._metrics, method)
+
+    def __call__(self, **kwargs):
+        start = time.perf_counter()
+        error_code = None
+        try:
+            return self._api(**kwargs)
+        except Exception as e:
+            error_code = getattr(e, "code", None) or type(e).__name__
+            raise
+        finally:
+            self._metrics.observe_api(self._method, time.perf_counter() - start, error_code)
+
+
+async def serve_metrics(metrics, host, port):
+    """Запуск HTTP-сервера метрик (/metrics) в текущем цикле событий asyncio"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не используются
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else ""
+            if path in ("/", "/metrics"):
+                status = "200 OK"
+                body = metrics.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
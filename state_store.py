@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+logger = logging.getLogger("VK_Bot.state")
+
+# Поля статистики, хранящие множества ID пользователей
+SEEN_USERS_KEYS = ("processed_users", "users_with_privacy_restrictions")
+
+# Поля профиля в страницах участников, сохраненных до выбора полей по фильтрам
+LEGACY_PAGE_FIELDS = ("sex", "bdate", "city", "last_seen", "has_photo")
+
+# Количество записей в журнале, после которого он сворачивается в снимок
+JOURNAL_COMPACT_EVERY = 500
+
+
+class SeenUsers:
+    """Множество ID пользователей с компактной сериализацией.
+
+    В памяти хранится как set (проверка вхождения за O(1)), на диске -
+    как отсортированные ID, закодированные разностями в varint и base64.
+    """
+
+    def __init__(self, user_ids=()):
+        self._ids = set(int(user_id) for user_id in user_ids)
+
+    def add(self, user_id):
+        self._ids.add(int(user_id))
+
+    def discard(self, user_id):
+        self._ids.discard(int(user_id))
+
+    def __contains__(self, user_id):
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def to_compact(self):
+        """Сериализация в строку (см. encode_ids)"""
+        return encode_ids(self._ids)
+
+    @classmethod
+    def from_compact(cls, value):
+        """Загрузка из строки to_compact() или из JSON-списка старого формата"""
+        if isinstance(value, list):
+            return cls(value)
+        return cls(decode_ids(value))
+
+
+def encode_ids(user_ids):
+    """Разности отсортированных ID в varint, закодированные в base64"""
+    data = bytearray()
+    previous = 0
+    for user_id in sorted(user_ids):
+        delta = user_id - previous
+        previous = user_id
+        while delta >= 0x80:
+            data.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return base64.b64encode(bytes(data)).decode("ascii")
+
+
+def decode_ids(value):
+    """Список ID из строки encode_ids()"""
+    user_ids = []
+    current = 0
+    delta = 0
+    shift = 0
+    for byte in base64.b64decode(value or ""):
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        current += delta
+        user_ids.append(current)
+        delta = 0
+        shift = 0
+    return user_ids
+
+
+class UserOutcomes:
+    """Результаты обработки пользователей: {ID: (результат, время записи)}.
+
+    Время записи - секунды Unix; срок действия результата определяет бот.
+    На диске результаты сгруппированы по (результат, время записи), ID
+    каждой группы закодированы как в SeenUsers.
+    """
+
+    def __init__(self):
+        self._items = {}
+
+    def get(self, user_id):
+        """Пара (результат, время записи) или None"""
+        return self._items.get(user_id)
+
+    def set(self, user_id, outcome, recorded_at):
+        self._items[int(user_id)] = (outcome, recorded_at)
+
+    def prune(self, before):
+        """Удаление результатов, записанных раньше before"""
+        self._items = {
+            user_id: item for user_id, item in self._items.items() if item[1] >= before
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+    def items(self):
+        """Тройки (ID, результат, время записи)"""
+        return ((user_id, outcome, recorded_at) for user_id, (outcome, recorded_at) in self._items.items())
+
+    def to_compact(self):
+        """Сериализация: {результат: [[время записи, ID в encode_ids], ...]}"""
+        groups = {}
+        for user_id, item in self._items.items():
+            groups.setdefault(item, []).append(user_id)
+        data = {}
+        for (outcome, recorded_at), user_ids in sorted(groups.items()):
+            data.setdefault(outcome, []).append([recorded_at, encode_ids(user_ids)])
+        return data
+
+    @classmethod
+    def from_compact(cls, value):
+        """Загрузка из to_compact() или из словаря {ID: [результат, время]}"""
+        outcomes = cls()
+        for key, item in (value or {}).items():
+            if key.isdigit():
+                outcomes.set(key, item[0], item[1])
+                continue
+            for recorded_at, user_ids in item:
+                for user_id in decode_ids(user_ids):
+                    outcomes._items[user_id] = (key, recorded_at)
+        return outcomes
+
+
+def write_json_atomic(path, data, indent=None):
+    """Запись JSON во временный файл и атомарная подмена исходного"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def default_stats():
+    """Начальное состояние бота"""
+    return {
+        "total_invites_sent": 0,
+        "invites_today": 0,
+        "last_invite_date": None,
+        "processed_users": SeenUsers(),
+        "users_with_privacy_restrictions": SeenUsers(),
+        "group_cache": {},
+        "user_outcomes": UserOutcomes(),
+        "last_activity_time": None
+    }
+
+
+class StateStore(ABC):
+    """Интерфейс хранилища состояния бота.
+
+    Состояние представлено словарем (см. default_stats), поля
+    SEEN_USERS_KEYS - объекты с операциями `in`, add() и len().
+    """
+
+    @abstractmethod
+    def load(self):
+        """Загрузка состояния"""
+
+    @abstractmethod
+    def record(self, stats, values=None, users=None, outcomes=None):
+        """Изменение состояния: values - новые значения полей,
+        users - словарь {поле: список ID} для добавления пользователей,
+        outcomes - словарь {ID: результат} для user_outcomes"""
+
+    @abstractmethod
+    def save(self, stats):
+        """Сохранение полного состояния"""
+
+
+class JournalStateStore(StateStore):
+    """Хранилище состояния: JSON-снимок и журнал изменений.
+
+    Каждое изменение дописывается в журнал одной строкой JSON с fsync.
+    Периодически журнал сворачивается в новый снимок, который подменяет
+    старый атомарным переименованием. При запуске состояние восстанавливается
+    из снимка и оставшихся записей журнала.
+    """
+
+    def __init__(self, snapshot_file, compact_every=JOURNAL_COMPACT_EVERY):
+        self.snapshot_file = snapshot_file
+        self.journal_file = snapshot_file + ".journal"
+        self.compact_every = compact_every
+        self.journal_records = 0
+
+    def load(self):
+        """Восстановление состояния из снимка и журнала"""
+        stats = default_stats()
+        legacy_snapshot = False
+
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key in SEEN_USERS_KEYS:
+                if key in data:
+                    data[key] = SeenUsers.from_compact(data[key])
+            if "user_outcomes" in data:
+                data["user_outcomes"] = UserOutcomes.from_compact(data["user_outcomes"])
+            else:
+                legacy_snapshot = True
+            stats.update(data)
+
+        self.journal_records = 0
+        skipped_records = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная запись при аварийном завершении
+                        logger.warning("Пропущена поврежденная запись журнала состояния")
+                        skipped_records += 1
+                        continue
+                    self.apply(stats, record)
+                    self.journal_records += 1
+
+        # Снимок без user_outcomes записан до появления срока действия
+        # ограничений приватности: такие ограничения остаются бессрочными
+        if legacy_snapshot:
+            for user_id in stats["users_with_privacy_restrictions"]:
+                stats["processed_users"].add(user_id)
+
+        # Сворачиваем журнал сразу, чтобы он не рос между перезапусками.
+        # Поврежденная запись тоже удаляется: иначе следующая запись
+        # допишется в ту же строку и будет потеряна при восстановлении
+        if (self.journal_records or skipped_records or legacy_snapshot
+                or not os.path.exists(self.snapshot_file)):
+            self.save(stats)
+
+        return stats
+
+    @staticmethod
+    def apply(stats, record):
+        """Применение записи журнала к состоянию"""
+        stats.update(record.get("set", {}))
+        for key, user_ids in record.get("add", {}).items():
+            for user_id in user_ids:
+                stats[key].add(user_id)
+        for user_id, (outcome, recorded_at) in record.get("outcomes", {}).items():
+            stats["user_outcomes"].set(user_id, outcome, recorded_at)
+
+    def record(self, stats, values=None, users=None, outcomes=None):
+        """Изменение состояния с записью в журнал"""
+        record = {}
+        if values:
+            record["set"] = values
+        if users:
+            record["add"] = {key: list(user_ids) for key, user_ids in users.items()}
+        if outcomes:
+            recorded_at = int(time.time())
+            record["outcomes"] = {
+                str(user_id): [outcome, recorded_at] for user_id, outcome in outcomes.items()
+            }
+        self.apply(stats, record)
+
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records += 1
+
+        if self.journal_records >= self.compact_every:
+            self.save(stats)
+
+    def save(self, stats):
+        """Запись полного снимка состояния и очистка журнала"""
+        data = dict(stats)
+        for key in SEEN_USERS_KEYS:
+            data[key] = stats[key].to_compact()
+        data["user_outcomes"] = stats["user_outcomes"].to_compact()
+
+        write_json_atomic(self.snapshot_file, data)
+
+        # Журнал очищается только после того, как снимок надежно записан
+        with open(self.journal_file, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records = 0
+
+
+class SQLiteSeenUsers:
+    """Множество пользователей, хранящееся в таблице users SQLite.
+
+    В множество входят строки со статусом из statuses; add() записывает
+    пользователю статус status.
+    """
+
+    def __init__(self, conn, status, statuses):
+        self.conn = conn
+        self.status = status
+        self.statuses = tuple(statuses)
+        self._where = " status IN (%s)" % ", ".join("?" * len(self.statuses))
+
+    def add(self, user_id):
+        now = datetime.now().isoformat()
+        self.conn.execute(
+            "INSERT INTO users (id, status, first_seen, last_action) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET last_action = excluded.last_action, status = excluded.status",
+            (int(user_id), self.status, now, now)
+        )
+
+    def __contains__(self, user_id):
+        row = self.conn.execute(
+            "SELECT 1 FROM users WHERE id = ? AND" + self._where, (user_id,) + self.statuses
+        ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM users WHERE" + self._where, self.statuses
+        ).fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self.conn.execute("SELECT id FROM users WHERE" + self._where, self.statuses))
+
+
+class SQLiteUserOutcomes:
+    """Результаты обработки пользователей в таблице outcomes SQLite"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, user_id):
+        return self.conn.execute(
+            "SELECT outcome, recorded_at FROM outcomes WHERE id = ?", (user_id,)
+        ).fetchone()
+
+    def set(self, user_id, outcome, recorded_at):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO outcomes (id, outcome, recorded_at) VALUES (?, ?, ?)",
+            (int(user_id), outcome, recorded_at)
+        )
+
+    def prune(self, before):
+        with self.conn:
+            self.conn.execute("DELETE FROM outcomes WHERE recorded_at < ?", (before,))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM outcomes").fetchone()[0]
+
+
+class SQLiteStateStore(StateStore):
+    """Хранилище состояния в базе SQLite.
+
+    Пользователи хранятся в индексированной таблице и не загружаются
+    в память, каждое изменение записывается одной транзакцией. При первом
+    запуске импортируется существующий stats.json.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            last_action TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_status ON users (status);
+        CREATE TABLE IF NOT EXISTS daily_counters (
+            date TEXT PRIMARY KEY,
+            invites INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS group_cache (
+            identifier TEXT PRIMARY KEY,
+            group_id INTEGER NOT NULL,
+            resolved_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS outcomes (
+            id INTEGER PRIMARY KEY,
+            outcome TEXT NOT NULL,
+            recorded_at INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_file, legacy_stats_file=None):
+        self.db_file = db_file
+        self.legacy_stats_file = legacy_stats_file
+        # Бот работает в отдельном потоке планировщика (см. BotScheduler)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            # База, созданная до появления таблицы outcomes: ограничения
+            # приватности в ней бессрочные
+            legacy = self._has_table("users") and not self._has_table("outcomes")
+            self.conn.executescript(self.SCHEMA)
+            if legacy:
+                self.conn.execute(
+                    "UPDATE users SET status = 'privacy_legacy' WHERE status = 'privacy_restricted'"
+                )
+
+    def _has_table(self, name):
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+
+    def load(self):
+        """Загрузка счетчиков состояния; пользователи остаются в базе"""
+        if self._get_meta("schema_created") is None:
+            self._migrate()
+
+        stats = default_stats()
+        stats["processed_users"] = SQLiteSeenUsers(self.conn, "processed", ("processed", "privacy_legacy"))
+        stats["users_with_privacy_restrictions"] = SQLiteSeenUsers(
+            self.conn, "privacy_restricted", ("privacy_restricted", "privacy_legacy")
+        )
+        stats["user_outcomes"] = SQLiteUserOutcomes(self.conn)
+
+        # Остальные поля (в том числе current_cycle и next_run_at) хранятся в meta
+        for key, value in self.conn.execute("SELECT key, value FROM meta"):
+            if key != "schema_created":
+                stats[key] = json.loads(value)
+
+        if stats["last_invite_date"]:
+            row = self.conn.execute(
+                "SELECT invites FROM daily_counters WHERE date = ?", (stats["last_invite_date"],)
+            ).fetchone()
+            stats["invites_today"] = row[0] if row else 0
+
+        stats["group_cache"] = {
+            identifier: {"id": group_id, "resolved_at": resolved_at}
+            for identifier, group_id, resolved_at in self.conn.execute(
+                "SELECT identifier, group_id, resolved_at FROM group_cache"
+            )
+        }
+        return stats
+
+    def record(self, stats, values=None, users=None, outcomes=None):
+        """Изменение состояния одной транзакцией"""
+        values = values or {}
+        with self.conn:
+            stats.update(values)
+            for key, value in values.items():
+                if key == "invites_today":
+                    date = values.get("last_invite_date") or datetime.now().strftime("%Y-%m-%d")
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO daily_counters (date, invites) VALUES (?, ?)",
+                        (date, value)
+                    )
+                elif key == "group_cache":
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO group_cache (identifier, group_id, resolved_at) VALUES (?, ?, ?)",
+                        [(identifier, item["id"], item["resolved_at"]) for identifier, item in value.items()]
+                    )
+                else:
+                    self._set_meta(key, json.dumps(value))
+            for key, user_ids in (users or {}).items():
+                for user_id in user_ids:
+                    stats[key].add(user_id)
+            recorded_at = int(time.time())
+            for user_id, outcome in (outcomes or {}).items():
+                stats["user_outcomes"].set(user_id, outcome, recorded_at)
+
+    def save(self, stats):
+        """Сохранение времени последней активности (остальное уже записано)"""
+        with self.conn:
+            self._set_meta("last_activity_time", json.dumps(stats["last_activity_time"]))
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _migrate(self):
+        """Импорт состояния из stats.json при создании базы"""
+        with self.conn:
+            if self.legacy_stats_file and os.path.exists(self.legacy_stats_file):
+                logger.info(f"Импорт состояния из {self.legacy_stats_file} в {self.db_file}")
+                legacy = JournalStateStore(self.legacy_stats_file).load()
+                now = datetime.now().isoformat()
+                restricted = legacy["users_with_privacy_restrictions"]
+                # Обработанные пользователи с ограничениями приватности -
+                # бессрочные ограничения, записанные до появления user_outcomes
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO users (id, status, first_seen, last_action) VALUES (?, ?, ?, ?)",
+                    [
+                        (user_id, "privacy_legacy" if user_id in restricted else "processed", now, now)
+                        for user_id in legacy["processed_users"]
+                    ]
+                )
+                # Ограничения со сроком действия (см. user_outcomes)
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO users (id, status, first_seen, last_action) VALUES (?, ?, ?, ?)",
+                    [(user_id, "privacy_restricted", now, now) for user_id in restricted]
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO outcomes (id, outcome, recorded_at) VALUES (?, ?, ?)",
+                    [
+                        (user_id, outcome, recorded_at)
+                        for user_id, outcome, recorded_at in legacy["user_outcomes"].items()
+                    ]
+                )
+                values = {
+                    key: value for key, value in legacy.items()
+                    if key not in SEEN_USERS_KEYS and key != "user_outcomes"
+                }
+                self.record(default_stats(), values)
+            self._set_meta("schema_created", json.dumps(datetime.now().isoformat()))
+
+
+class MemberSnapshot:
+    """Локальная копия участников группы с курсором обхода.
+
+    Каждая страница groups.getMembers хранится в отдельном файле
+    <offset>.json вместе со временем получения, курсор и известное
+    количество участников - в cursor.json.
+    """
+
+    def __init__(self, directory, group_id):
+        self.directory = os.path.join(directory, str(group_id))
+        os.makedirs(self.directory, exist_ok=True)
+        self.cursor_file = os.path.join(self.directory, "cursor.json")
+
+        self.cursor = 0
+        self.count = None
+        if os.path.exists(self.cursor_file):
+            try:
+                with open(self.cursor_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.cursor = data["cursor"]
+                self.count = data["count"]
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Не удалось прочитать курсор участников группы {group_id}: {e}")
+
+    def _page_file(self, offset):
+        return os.path.join(self.directory, f"{offset}.json")
+
+    def get_page(self, offset, ttl, fields):
+        """Страница участников, если она сохранена, не старше ttl и содержит
+        все поля fields, иначе None"""
+        path = self._page_file(offset)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                page = json.load(f)
+        except ValueError:
+            return None
+        if datetime.now() - datetime.fromisoformat(page["fetched_at"]) >= ttl:
+            return None
+        if not set(fields) <= set(page.get("fields", LEGACY_PAGE_FIELDS)):
+            return None
+        return page["items"]
+
+    def put_page(self, offset, items, fields):
+        """Сохранение полученной страницы участников с полями fields"""
+        write_json_atomic(self._page_file(offset), {
+            "fetched_at": datetime.now().isoformat(),
+            "fields": list(fields),
+            "items": items
+        })
+
+    def set_cursor(self, offset, count):
+        """Сохранение позиции обхода и количества участников группы"""
+        self.cursor = offset
+        self.count = count
+        write_json_atomic(self.cursor_file, {"cursor": offset, "count": count})
+
+
+def create_state_store(backend, stats_file, db_file):
+    """Создание хранилища состояния по имени бэкенда ("json" или "sqlite")"""
+    if backend == "sqlite":
+        return SQLiteStateStore(db_file, legacy_stats_file=stats_file)
+    if backend != "json":
+        logger.warning(f"Неизвестный бэкенд состояния '{backend}', используется json")
+    return JournalStateStore(stats_file)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Логгер бота настраивается при импорте vk_bot: в тестах без файла лога
+os.environ["LOG_FILE"] = ""
+
+import vk_bot  # noqa: E402
+from fake_vk_server import FakeVkApi, FakeVkServer, generate_members  # noqa: E402
+from vk_transport import VkHttpSession  # noqa: E402
+
+# Настройки бота для тестов; перекрывают значения из .env
+TEST_ENV = {
+    "VK_ACCESS_TOKEN": "test",
+    "TARGET_GROUP_ID": "target",
+    "YOUR_GROUP_ID": "ours",
+    "MAX_INVITES_PER_DAY": "20",
+    "MIN_DELAY": "0",
+    "MAX_DELAY": "0",
+    "STATE_BACKEND": "json",
+    "USE_EXECUTE": "False",
+    "LAZY_PROFILE_FIELDS": "False",
+    "FILTER_AGE_ENABLED": "False",
+    "FILTER_SEX_ENABLED": "False",
+    "FILTER_CITY_ENABLED": "False",
+    "FILTER_PHOTO_ENABLED": "False",
+    "FILTER_LAST_SEEN_ENABLED": "True",
+    "FILTER_LAST_SEEN_DAYS": "30",
+}
+
+
+@pytest.fixture(autouse=True)
+def group_id_cache(monkeypatch):
+    """Кэш ID групп процесса не переходит из теста в тест"""
+    cache = {}
+    monkeypatch.setattr(vk_bot, "_group_id_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Паузы бота не выполняются, а записываются"""
+    recorded = []
+    monkeypatch.setattr(vk_bot.time, "sleep", recorded.append)
+    return recorded
+
+
+@pytest.fixture
+def fake_vk():
+    """Фабрика фиктивных VK API на локальном HTTP-сервере"""
+    servers = []
+
+    def start(members=3000, our_share=3, errors=()):
+        users = generate_members(members, seed=1)
+        api = FakeVkApi(
+            groups={"target": 1, "ours": 2},
+            members=users,
+            our_members=[user["id"] for user in users[::our_share]],
+            errors=errors
+        )
+        servers.append(FakeVkServer(api).start())
+        api.server = servers[-1]
+        return api
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def make_bot(tmp_path, monkeypatch, sleeps):
+    """Фабрика ботов с состоянием в tmp_path, подключенных к фиктивному API"""
+    monkeypatch.chdir(tmp_path)
+    for key, value in TEST_ENV.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setenv("MEMBERS_CACHE_DIR", str(tmp_path / "members_cache"))
+
+    def create(api=None, **env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        base_url = api.server.api_url if api else "http://127.0.0.1:9/method/"
+        return vk_bot.VKInviteBot(session=VkHttpSession(base_url=base_url))
+
+    return create
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import vk_bot
+from state_store import MemberSnapshot
+
+PRIVACY_ERROR = {"method": "groups.invite", "error_code": 15,
+                 "error_msg": "Access denied: can't add this user", "times": 2}
+
+
+def age_outcome(bot, user_id, days):
+    """Сдвиг времени записи результата пользователя в прошлое"""
+    outcome, recorded_at = bot.stats["user_outcomes"].get(user_id)
+    bot.stats["user_outcomes"].set(user_id, outcome, recorded_at - days * 86400)
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+@pytest.mark.parametrize("use_execute", [False, True])
+def test_run_invites_only_new_users(fake_vk, make_bot, backend, use_execute):
+    api = fake_vk(errors=[PRIVACY_ERROR])
+    bot = make_bot(api, STATE_BACKEND=backend, USE_EXECUTE=use_execute)
+    bot.run()
+
+    # Не больше 10 приглашений за запуск, участники нашей группы пропускаются
+    assert api.calls["groups.invite"] == 10
+    assert len(api.invited) == 8
+    assert not set(api.invited) & api.our_members
+    assert bot.stats["total_invites_sent"] == 8
+    assert bot.stats["invites_today"] == 8
+    assert bot.stats["current_cycle"] is None
+    assert len(bot.stats["users_with_privacy_restrictions"]) == 2
+
+    # Все приглашенные проходят фильтр по последней активности
+    members = {user["id"]: user for user in api.members}
+    cutoff = time.time() - 31 * 86400
+    for user_id in api.invited:
+        assert members[user_id].get("last_seen", {"time": cutoff + 1})["time"] > cutoff
+
+    # Следующий запуск не приглашает тех же пользователей повторно
+    restarted = make_bot(api)
+    restarted.run()
+    assert api.calls["groups.invite"] == 20
+    assert len(set(api.invited)) == 18
+
+
+def test_run_respects_daily_limit(fake_vk, make_bot):
+    api = fake_vk()
+    bot = make_bot(api, MAX_INVITES_PER_DAY=3)
+    bot.run()
+    bot.run()
+    assert len(api.invited) == 3
+    assert bot.invites_left() == 0
+
+
+def test_failed_page_is_skipped(fake_vk, make_bot, sleeps):
+    api = fake_vk(errors=[{"method": "groups.getMembers", "error_code": 10,
+                           "error_msg": "Internal server error", "params": {"offset": 1000}}])
+    bot = make_bot(api)
+    pages = list(bot.get_group_members("target", 5000))
+
+    assert [page[0]["id"] for page in pages] == [api.members[0]["id"], api.members[2000]["id"]]
+    # Первый запрос и PAGE_RETRY_ATTEMPTS повторов
+    assert api.calls["groups.getMembers"] == 3 + vk_bot.PAGE_RETRY_ATTEMPTS
+    assert sleeps.count(vk_bot.PAGE_RETRY_DELAY) == 1
+
+
+def test_captcha_stops_crawl_with_pause(fake_vk, make_bot, sleeps):
+    api = fake_vk(errors=[{"method": "groups.getMembers", "error_code": 14,
+                           "error_msg": "Captcha needed", "params": {"offset": 1000}}])
+    bot = make_bot(api)
+    pages = list(bot.get_group_members("target", 5000))
+
+    assert len(pages) == 1
+    assert 900 in sleeps
+
+
+def test_transient_invite_error_is_retried_after_ttl(fake_vk, make_bot):
+    api = fake_vk(errors=[{"method": "groups.invite", "error_code": 10,
+                           "error_msg": "Internal server error", "times": 1}])
+    bot = make_bot(api)
+    bot.run()
+
+    [user_id] = [user_id for user_id, outcome, _ in bot.stats["user_outcomes"].items() if outcome == "transient"]
+    assert user_id not in bot.stats["processed_users"]
+    assert bot.get_outcome(user_id) == "transient"
+    assert bot.is_known_user(user_id)
+
+    age_outcome(bot, user_id, 1)
+    assert not bot.is_known_user(user_id)
+
+
+def test_http_502_on_invite_is_transient(fake_vk, make_bot):
+    api = fake_vk(errors=[{"method": "groups.invite", "http_status": 502, "times": 1}])
+    bot = make_bot(api)
+    bot.run()
+
+    outcomes = [outcome for _, outcome, _ in bot.stats["user_outcomes"].items()]
+    assert outcomes.count("transient") == 1
+    assert "error" not in outcomes
+    assert len(api.invited) == 9
+
+
+def test_http_502_on_members_page_is_retried(fake_vk, make_bot, sleeps):
+    api = fake_vk(errors=[{"method": "groups.getMembers", "http_status": 502,
+                           "params": {"offset": 1000}, "times": 1}])
+    bot = make_bot(api)
+    pages = list(bot.get_group_members("target", 3000))
+
+    assert [page[0]["id"] for page in pages] == [api.members[offset]["id"] for offset in (0, 1000, 2000)]
+    assert sleeps.count(vk_bot.PAGE_RETRY_DELAY) == 1
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_privacy_outcome_expires_across_restart(make_bot, backend):
+    bot = make_bot(STATE_BACKEND=backend, TARGET_GROUP_ID=1, YOUR_GROUP_ID=2)
+    bot.update_stats(users={"users_with_privacy_restrictions": [7]}, outcomes={7: "privacy"})
+    assert bot.is_known_user(7)
+
+    age_outcome(bot, 7, 91)
+    bot.save_stats()
+    assert not bot.is_known_user(7)
+
+    restarted = make_bot()
+    assert not restarted.is_known_user(7)
+    # История ограничений сохраняется
+    assert 7 in restarted.stats["users_with_privacy_restrictions"]
+
+
+def test_legacy_json_privacy_restrictions_stay_permanent(make_bot, tmp_path):
+    (tmp_path / "stats.json").write_text(json.dumps({
+        "total_invites_sent": 1,
+        "invites_today": 0,
+        "last_invite_date": None,
+        "processed_users": [5],
+        "users_with_privacy_restrictions": [9],
+        "group_cache": {}
+    }))
+    bot = make_bot(TARGET_GROUP_ID=1, YOUR_GROUP_ID=2)
+    assert bot.is_known_user(9)
+    assert make_bot().is_known_user(9)
+
+
+def test_legacy_sqlite_privacy_restrictions_stay_permanent(make_bot, tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "stats.db"))
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, status TEXT NOT NULL,
+                            first_seen TEXT NOT NULL, last_action TEXT NOT NULL);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        INSERT INTO users VALUES (11, 'privacy_restricted', 'x', 'x');
+        INSERT INTO meta VALUES ('schema_created', '"x"');
+    """)
+    conn.commit()
+    conn.close()
+
+    bot = make_bot(STATE_BACKEND="sqlite", TARGET_GROUP_ID=1, YOUR_GROUP_ID=2)
+    assert bot.is_known_user(11)
+    assert 11 in bot.stats["users_with_privacy_restrictions"]
+
+
+def test_scheduler_waits_when_cycle_blocked_by_limit(make_bot, monkeypatch):
+    bot = make_bot(MAX_INVITES_PER_DAY=5, TARGET_GROUP_ID=1, YOUR_GROUP_ID=2)
+    next_run_at = datetime.now() + timedelta(hours=4)
+    bot.update_stats({
+        "current_cycle": {"user_ids": [1, 2, 3], "done": 1, "next_invite_at": None},
+        "invites_today": 5,
+        "last_invite_date": datetime.now().strftime("%Y-%m-%d"),
+        "next_run_at": next_run_at.isoformat()
+    })
+
+    waits = []
+
+    async def fake_sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(vk_bot.asyncio, "sleep", fake_sleep)
+    asyncio.run(vk_bot.BotScheduler(bot).wait_for_next_run())
+    assert len(waits) == 1 and waits[0] > 3 * 3600
+
+    # Цикл сохраняется, пока лимит не сброшен
+    bot.run_cycle()
+    assert bot.stats["current_cycle"]["done"] == 1
+
+    # На следующий день прерванный цикл продолжается без ожидания
+    bot.update_stats({"last_invite_date": "2000-01-01"})
+    waits.clear()
+    asyncio.run(vk_bot.BotScheduler(bot).wait_for_next_run())
+    assert waits == []
+
+
+def test_resumed_cycle_skips_already_invited_users(fake_vk, make_bot):
+    api = fake_vk()
+    bot = make_bot(api)
+    # Приглашение записано в состояние, но план цикла не успел обновиться
+    bot.update_stats({"current_cycle": {"user_ids": [101, 102, 103], "done": 0, "next_invite_at": None}},
+                     users={"processed_users": [101]})
+    bot.run_cycle()
+
+    assert api.invited == [102, 103]
+    assert bot.stats["current_cycle"] is None
+
+
+def test_resumed_cycle_kept_until_all_invites_sent(fake_vk, make_bot):
+    api = fake_vk()
+    bot = make_bot(api, MAX_INVITES_PER_DAY=3)
+    bot.update_stats({"current_cycle": {"user_ids": [101, 102, 103, 104, 105], "done": 0, "next_invite_at": None}})
+    bot.run_cycle()
+
+    assert api.invited == [101, 102, 103]
+    assert bot.stats["current_cycle"]["done"] == 3
+
+    # На следующий день отправляются оставшиеся приглашения плана
+    bot.update_stats({"last_invite_date": "2000-01-01"})
+    bot.run_cycle()
+    assert api.invited == [101, 102, 103, 104, 105]
+    assert bot.stats["current_cycle"] is None
+
+
+@pytest.mark.parametrize("use_execute", [False, True])
+def test_membership_checked_in_batches(fake_vk, make_bot, use_execute):
+    api = fake_vk()
+    bot = make_bot(api, USE_EXECUTE=use_execute)
+    api.calls.clear()
+    user_ids = [user["id"] for user in api.members[:1200]]
+    membership = bot.check_membership(user_ids)
+
+    # По MEMBERSHIP_BATCH_SIZE пользователей в запросе, с execute - одним запросом
+    assert api.calls["groups.isMember"] == 3
+    assert api.calls["execute"] == (1 if use_execute else 0)
+    assert membership == {user_id: user_id in api.our_members for user_id in user_ids}
+
+
+def test_group_ids_cached_across_bots(fake_vk, make_bot, group_id_cache):
+    api = fake_vk()
+    make_bot(api)
+    resolved = api.calls["groups.getById"]
+    assert resolved and group_id_cache == {"target": 1, "ours": 2}
+
+    # Новый бот в том же процессе берет ID из кэша процесса
+    make_bot(api)
+    assert api.calls["groups.getById"] == resolved
+
+    # После перезапуска - из файла состояния
+    group_id_cache.clear()
+    make_bot(api)
+    assert api.calls["groups.getById"] == resolved
+
+    # Устаревшие записи запрашиваются заново
+    expired = (datetime.now() - vk_bot.GROUP_ID_CACHE_TTL - timedelta(hours=1)).isoformat()
+    bot = make_bot(api)
+    bot.update_stats({"group_cache": {
+        key: dict(value, resolved_at=expired) for key, value in bot.stats["group_cache"].items()
+    }})
+    group_id_cache.clear()
+    make_bot(api)
+    assert api.calls["groups.getById"] > resolved
+
+
+def test_members_crawl_resumes_from_cursor_and_wraps(fake_vk, make_bot):
+    api = fake_vk()
+    bot = make_bot(api)
+
+    offsets = {user["id"]: offset for offset, user in enumerate(api.members)}
+
+    def crawl():
+        pages = list(bot.get_group_members("target", 2000))
+        cursor = MemberSnapshot(bot.config["members_cache_dir"], 1).cursor
+        return [offsets[page[0]["id"]] for page in pages], cursor
+
+    assert crawl() == ([0, 1000], 1000)
+    assert api.calls["groups.getMembers"] == 2
+
+    # Следующий обход начинается с курсора; свежая страница не запрашивается повторно
+    assert crawl() == ([1000, 2000], 2000)
+    assert api.calls["groups.getMembers"] == 3
+
+    # Дойдя до конца группы, обход продолжается с начала
+    assert crawl() == ([2000, 0], 0)
+    assert api.calls["groups.getMembers"] == 3
+
+
+def requested_params(api, method):
+    return [params for name, params in api.requests if name == method]
+
+
+@pytest.mark.parametrize("env, fields", [
+    ({}, "last_seen"),
+    ({"FILTER_AGE_ENABLED": True, "FILTER_PHOTO_ENABLED": True}, "last_seen,has_photo,bdate"),
+    ({"FILTER_LAST_SEEN_ENABLED": False}, None),
+])
+def test_members_requested_with_filter_fields(fake_vk, make_bot, env, fields):
+    api = fake_vk()
+    bot = make_bot(api, **env)
+    [page] = bot.get_group_members("target", 1000)
+
+    [params] = requested_params(api, "groups.getMembers")
+    assert params.get("fields") == fields
+    if fields is None:
+        # Без полей VK возвращает только ID участников
+        assert page == [{"id": user["id"]} for user in api.members[:1000]]
+
+
+def test_lazy_profile_fields_fetched_for_new_users(fake_vk, make_bot):
+    api = fake_vk()
+    bot = make_bot(api, LAZY_PROFILE_FIELDS=True)
+    known = api.members[0]["id"]
+    bot.update_stats(users={"processed_users": [known]})
+    [page] = bot.get_group_members("target", 1000)
+    candidates = bot.filter_users(page)
+
+    assert "fields" not in requested_params(api, "groups.getMembers")[0]
+    [params] = requested_params(api, "users.get")
+    assert params["fields"] == "last_seen"
+    user_ids = [int(user_id) for user_id in params["user_ids"].split(",")]
+    assert user_ids == [user["id"] for user in api.members[1:1000]]
+
+    cutoff = time.time() - 31 * 86400
+    assert candidates
+    assert all(user.get("last_seen", {"time": cutoff + 1})["time"] > cutoff for user in candidates)
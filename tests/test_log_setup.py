@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import logging
+
+import pytest
+
+import log_setup
+
+
+@pytest.fixture
+def fresh_logging(tmp_path, monkeypatch):
+    """setup_logging() с чистого листа; настройки логгеров восстанавливаются после теста"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    component_levels = {
+        name: logging.getLogger(name).level
+        for name in ("VK_Bot", "VK_Bot.state", "VK_Bot.invite")
+    }
+    monkeypatch.setattr(log_setup, "_listener", None)
+    monkeypatch.setattr(log_setup.atexit, "register", lambda func: func)
+    monkeypatch.setenv("LOG_FILE", str(tmp_path / "bot.log"))
+
+    def setup(**env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        return log_setup.setup_logging()
+
+    yield setup
+    if log_setup._listener is not None and log_setup._listener._thread is not None:
+        log_setup._listener.stop()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    for name, component_level in component_levels.items():
+        logging.getLogger(name).setLevel(component_level)
+
+
+def test_parse_levels():
+    assert log_setup.parse_levels("state=warning, invite = DEBUG,,bad,=INFO") == {
+        "state": "WARNING", "invite": "DEBUG"
+    }
+    assert log_setup.parse_levels("") == {}
+
+
+def test_queue_listener_writes_component_levels(fresh_logging, tmp_path):
+    listener = fresh_logging(LOG_FORMAT="json", LOG_LEVEL="INFO", LOG_LEVELS="state=WARNING,invite=DEBUG")
+    assert listener is log_setup.setup_logging()
+
+    logging.getLogger("VK_Bot.state").info("state info")
+    logging.getLogger("VK_Bot.state").warning("state warning")
+    logging.getLogger("VK_Bot.invite").debug("invite debug")
+    logging.getLogger("VK_Bot").debug("bot debug")
+    # Записи пишет поток QueueListener; stop() дожидается их обработки
+    listener.stop()
+
+    with open(tmp_path / "bot.log", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert [(entry["logger"], entry["level"], entry["msg"]) for entry in entries] == [
+        ("VK_Bot.state", "WARNING", "state warning"),
+        ("VK_Bot.invite", "DEBUG", "invite debug"),
+    ]
+
+
+def test_rotated_logs_are_compressed(fresh_logging, tmp_path):
+    listener = fresh_logging(LOG_FORMAT="text", LOG_MAX_BYTES="2000", LOG_BACKUP_COUNT="2")
+    for i in range(100):
+        logging.getLogger("VK_Bot").warning(f"message {i}")
+    listener.stop()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["bot.log", "bot.log.1.gz", "bot.log.2.gz"]
+    with gzip.open(tmp_path / "bot.log.1.gz", "rt", encoding="utf-8") as f:
+        assert "VK_Bot - WARNING - message" in f.read()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime
+
+from member_filter import MemberColumns, filter_mask, member_fields
+
+NOW = datetime(2026, 6, 15, 12, 0, 0)
+
+
+def reference_is_suitable(user, filters, now):
+    """Проверка пользователя в том виде, в котором ее выполнял исходный
+    цикл filter_users"""
+    is_suitable = True
+
+    if filters["last_seen_days"]["enabled"] and "last_seen" in user:
+        days_ago = (now - datetime.fromtimestamp(user["last_seen"]["time"])).days
+        if days_ago > filters["last_seen_days"]["value"]:
+            is_suitable = False
+
+    if filters["sex"]["enabled"] and filters["sex"]["value"] != 0:
+        if "sex" not in user or user["sex"] != filters["sex"]["value"]:
+            is_suitable = False
+
+    if filters["city_id"]["enabled"]:
+        if "city" not in user or user["city"]["id"] != filters["city_id"]["value"]:
+            is_suitable = False
+
+    if filters["has_photo"]["enabled"]:
+        if "has_photo" not in user or user["has_photo"] != 1:
+            is_suitable = False
+
+    if filters["age"]["enabled"] and "bdate" in user:
+        try:
+            bdate = user["bdate"]
+            if len(bdate.split(".")) == 3:
+                birth_date = datetime.strptime(bdate, "%d.%m.%Y")
+                age = (now - birth_date).days // 365
+                if age < filters["age"]["min"] or age > filters["age"]["max"]:
+                    is_suitable = False
+        except Exception:
+            pass
+
+    return is_suitable
+
+
+def random_user(rnd, user_id):
+    user = {"id": user_id}
+    if rnd.random() < 0.8:
+        user["sex"] = rnd.choice((0, 1, 2))
+    if rnd.random() < 0.5:
+        user["city"] = {"id": rnd.choice((1, 2, 3))}
+    if rnd.random() < 0.9:
+        user["has_photo"] = rnd.choice((0, 1))
+    if rnd.random() < 0.85:
+        user["last_seen"] = {"time": NOW.timestamp() - rnd.uniform(0, 90) * 86400}
+    share = rnd.random()
+    if share < 0.4:
+        user["bdate"] = f"{rnd.randint(1, 28)}.{rnd.randint(1, 12)}.{rnd.randint(1950, 2015)}"
+    elif share < 0.6:
+        # Дата рождения без года
+        user["bdate"] = f"{rnd.randint(1, 28)}.{rnd.randint(1, 12)}"
+    elif share < 0.65:
+        user["bdate"] = rnd.choice(("31.2.1990", "1.13.1990", "0.1.1990", "x.y.z", "01.01.1990"))
+    return user
+
+
+def random_filters(rnd):
+    return {
+        "age": {"enabled": rnd.random() < 0.5, "min": rnd.randint(10, 30), "max": rnd.randint(30, 70)},
+        "sex": {"enabled": rnd.random() < 0.5, "value": rnd.choice((0, 1, 2))},
+        "city_id": {"enabled": rnd.random() < 0.5, "value": rnd.choice((1, 2))},
+        "has_photo": {"enabled": rnd.random() < 0.5},
+        "last_seen_days": {"enabled": rnd.random() < 0.7, "value": rnd.randint(0, 60)},
+    }
+
+
+def test_filter_mask_matches_original_loop():
+    rnd = random.Random(1)
+    users = [random_user(rnd, user_id) for user_id in range(1, 5001)]
+
+    for _ in range(40):
+        filters = random_filters(rnd)
+        mask = filter_mask(MemberColumns(users), filters, now=NOW)
+        expected = [reference_is_suitable(user, filters, NOW) for user in users]
+        assert [bool(ok) for ok in mask] == expected, filters
+
+
+def test_missing_fields():
+    users = [{"id": 1}]
+    filters = {
+        "age": {"enabled": True, "min": 18, "max": 30},
+        "sex": {"enabled": False, "value": 0},
+        "city_id": {"enabled": False, "value": 1},
+        "has_photo": {"enabled": False},
+        "last_seen_days": {"enabled": True, "value": 30},
+    }
+    # Без даты рождения и последней активности пользователь проходит фильтры
+    assert list(filter_mask(MemberColumns(users), filters, now=NOW)) == [1]
+
+    # Город и фото без соответствующих полей не проходят
+    filters["city_id"]["enabled"] = True
+    assert list(filter_mask(MemberColumns(users), filters, now=NOW)) == [0]
+
+
+def test_member_fields_follow_enabled_filters():
+    filters = {
+        "age": {"enabled": True, "min": 18, "max": 30},
+        "sex": {"enabled": True, "value": 0},
+        "city_id": {"enabled": False, "value": 1},
+        "has_photo": {"enabled": True},
+        "last_seen_days": {"enabled": False, "value": 30},
+    }
+    # Фильтр по полу со значением 0 выключен
+    assert member_fields(filters) == ["has_photo", "bdate"]
+
+    for key in filters:
+        filters[key]["enabled"] = False
+    assert member_fields(filters) == []
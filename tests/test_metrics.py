@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+import vk_bot
+from metrics import Metrics, serve_metrics
+
+
+def sample_metrics():
+    metrics = Metrics()
+    metrics.observe_api("groups.getMembers", 0.2)
+    metrics.observe_api("groups.getMembers", 0.07, error_code=10)
+    metrics.observe_sleep("members_page", 2)
+    metrics.observe_sleep("cycle_wait", 100)
+    metrics.observe_run(5)
+    return metrics
+
+
+def test_snapshot():
+    snapshot = sample_metrics().snapshot()
+    api = snapshot["api"]["groups.getMembers"]
+    assert api["calls"] == 2
+    assert api["seconds"] == 0.27
+    assert (api["buckets"]["0.05"], api["buckets"]["0.1"], api["buckets"]["0.25"], api["buckets"]["inf"]) == (0, 1, 2, 2)
+    assert snapshot["api_errors"] == {"groups.getMembers:10": 1}
+    assert snapshot["sleep"]["members_page"] == {"count": 1, "seconds": 2}
+    # Ожидание следующего цикла не входит во время запуска
+    assert snapshot["work_seconds"] == 2.73
+
+
+def test_render():
+    lines = sample_metrics().render().splitlines()
+    assert 'vk_api_calls_total{method="groups.getMembers"} 2' in lines
+    assert 'vk_api_errors_total{method="groups.getMembers",code="10"} 1' in lines
+    assert 'vk_api_latency_seconds_bucket{method="groups.getMembers",le="0.1"} 1' in lines
+    assert 'vk_api_latency_seconds_bucket{method="groups.getMembers",le="+Inf"} 2' in lines
+    assert 'vk_api_latency_seconds_count{method="groups.getMembers"} 2' in lines
+    assert 'vk_sleeps_total{reason="cycle_wait"} 1' in lines
+    assert "vk_runs_total 1" in lines
+
+
+@pytest.mark.parametrize("error, code", [
+    ({"error_code": 15, "error_msg": "Access denied"}, "15"),
+    ({"http_status": 502}, "ApiHttpError"),
+])
+def test_instrumented_api_records_error_codes(fake_vk, make_bot, monkeypatch, error, code):
+    monkeypatch.setattr(vk_bot, "_metrics", Metrics())
+    api = fake_vk(errors=[dict(error, method="groups.invite", times=1)])
+    bot = make_bot(api)
+
+    assert not bot.invite_user(api.members[1]["id"])
+    assert bot.invite_user(api.members[2]["id"])
+    snapshot = bot.metrics.snapshot()
+    assert snapshot["api"]["groups.invite"]["calls"] == 2
+    assert snapshot["api_errors"] == {f"groups.invite:{code}": 1}
+
+
+def test_serve_metrics():
+    metrics = sample_metrics()
+
+    async def fetch(path):
+        server = await serve_metrics(metrics, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response.decode("utf-8")
+
+    response = asyncio.run(fetch("/metrics"))
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert response.endswith(metrics.render())
+    assert asyncio.run(fetch("/other")).startswith("HTTP/1.1 404")
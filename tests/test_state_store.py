@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import random
+from datetime import timedelta
+
+import pytest
+
+from state_store import JournalStateStore, MemberSnapshot, SeenUsers, SQLiteStateStore, StateStore, UserOutcomes
+
+
+def test_seen_users_compact_roundtrip():
+    user_ids = random.Random(1).sample(range(1, 10 ** 9), 1000)
+    seen = SeenUsers.from_compact(SeenUsers(user_ids).to_compact())
+    assert sorted(seen) == sorted(user_ids)
+    # Старый формат - JSON-список
+    assert sorted(SeenUsers.from_compact([3, 1, 2])) == [1, 2, 3]
+
+
+def test_user_outcomes_compact_roundtrip():
+    outcomes = UserOutcomes()
+    for user_id in range(1, 100):
+        outcomes.set(user_id * 7, "member" if user_id % 3 else "privacy", 1000 + user_id % 2)
+    restored = UserOutcomes.from_compact(json.loads(json.dumps(outcomes.to_compact())))
+    assert sorted(restored.items()) == sorted(outcomes.items())
+    # Старый формат {ID: [результат, время]}
+    assert list(UserOutcomes.from_compact({"5": ["member", 10]}).items()) == [(5, "member", 10)]
+
+
+def test_journal_replay_skips_truncated_tail(tmp_path):
+    stats_file = str(tmp_path / "stats.json")
+    store = JournalStateStore(stats_file)
+    stats = store.load()
+    store.record(stats, {"total_invites_sent": 1}, {"processed_users": [10]})
+    store.record(stats, {"total_invites_sent": 2}, {"processed_users": [20]}, {30: "member"})
+
+    # Запись, недописанная при аварийном завершении
+    with open(stats_file + ".journal", "a", encoding="utf-8") as f:
+        f.write('{"set": {"total_invites_sent": 3}, "add": {"processed_us')
+
+    restored = JournalStateStore(stats_file).load()
+    assert restored["total_invites_sent"] == 2
+    assert sorted(restored["processed_users"]) == [10, 20]
+    assert restored["user_outcomes"].get(30)[0] == "member"
+
+    # Журнал свернут в снимок
+    with open(stats_file + ".journal", encoding="utf-8") as f:
+        assert f.read() == ""
+
+
+def test_journal_torn_first_record_after_compaction(tmp_path):
+    stats_file = str(tmp_path / "stats.json")
+    JournalStateStore(stats_file).load()
+
+    # Журнал после свертки содержит только недописанную запись
+    with open(stats_file + ".journal", "w", encoding="utf-8") as f:
+        f.write('{"set": {"total_invites_sent": 1}, "add": {"processed_us')
+
+    store = JournalStateStore(stats_file)
+    stats = store.load()
+    assert stats["total_invites_sent"] == 0
+    store.record(stats, {"total_invites_sent": 5}, {"processed_users": [40]})
+
+    restored = JournalStateStore(stats_file).load()
+    assert restored["total_invites_sent"] == 5
+    assert list(restored["processed_users"]) == [40]
+
+
+def test_incomplete_backend_fails_on_construction():
+    class NoSaveStore(StateStore):
+        def load(self):
+            return {}
+
+        def record(self, stats, values=None, users=None, outcomes=None):
+            pass
+
+    with pytest.raises(TypeError):
+        NoSaveStore()
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_state_roundtrip(tmp_path, backend):
+    def open_store():
+        if backend == "sqlite":
+            return SQLiteStateStore(str(tmp_path / "stats.db"))
+        return JournalStateStore(str(tmp_path / "stats.json"))
+
+    store = open_store()
+    stats = store.load()
+    cycle = {"user_ids": [1, 2, 3], "done": 1, "next_invite_at": None}
+    store.record(stats, {"current_cycle": cycle, "next_run_at": "2030-01-01T00:00:00",
+                         "invites_today": 4, "last_invite_date": "2030-01-01"},
+                 {"processed_users": [1], "users_with_privacy_restrictions": [2]}, {2: "privacy"})
+    store.save(stats)
+
+    restored = open_store().load()
+    assert restored["current_cycle"] == cycle
+    assert restored["next_run_at"] == "2030-01-01T00:00:00"
+    assert restored["invites_today"] == 4
+    assert 1 in restored["processed_users"]
+    # Пользователь с ограничениями приватности не считается обработанным
+    assert 2 not in restored["processed_users"]
+    assert 2 in restored["users_with_privacy_restrictions"]
+    assert restored["user_outcomes"].get(2)[0] == "privacy"
+
+
+def test_sqlite_imports_legacy_stats(tmp_path):
+    stats_file = tmp_path / "stats.json"
+    stats_file.write_text(json.dumps({
+        "total_invites_sent": 5,
+        "invites_today": 2,
+        "last_invite_date": "2030-01-01",
+        "processed_users": [1, 2, 3],
+        "users_with_privacy_restrictions": [3],
+        "group_cache": {}
+    }))
+    stats = SQLiteStateStore(str(tmp_path / "stats.db"), legacy_stats_file=str(stats_file)).load()
+    assert stats["total_invites_sent"] == 5
+    assert stats["invites_today"] == 2
+    assert sorted(stats["processed_users"]) == [1, 2, 3]
+    assert list(stats["users_with_privacy_restrictions"]) == [3]
+
+
+def test_member_snapshot_pages_and_cursor(tmp_path):
+    snapshot = MemberSnapshot(str(tmp_path), 1)
+    snapshot.put_page(1000, [{"id": 5, "sex": 1}], ["sex"])
+    snapshot.set_cursor(1000, 3000)
+
+    restored = MemberSnapshot(str(tmp_path), 1)
+    assert (restored.cursor, restored.count) == (1000, 3000)
+    assert restored.get_page(1000, timedelta(days=1), ["sex"]) == [{"id": 5, "sex": 1}]
+    assert restored.get_page(1000, timedelta(days=1), []) == [{"id": 5, "sex": 1}]
+    # Устаревшая страница и страница без нужных полей запрашиваются заново
+    assert restored.get_page(1000, timedelta(0), ["sex"]) is None
+    assert restored.get_page(1000, timedelta(days=1), ["sex", "bdate"]) is None
+    assert restored.get_page(0, timedelta(days=1), []) is None
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import vk_api
+import asyncio
+import threading
 import time
 import random
 import json
@@ -10,29 +12,86 @@ import logging
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from log_setup import setup_logging
+from metrics import InstrumentedApi, Metrics, serve_metrics
+from member_filter import MemberColumns, filter_mask, member_fields
+from state_store import MemberSnapshot, create_state_store, default_stats
+from vk_errors import RETRYABLE_ERRORS, classify_error
+from vk_transport import VK_API_URL, create_session
+
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("vk_bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# Настройка логирования (запись в файл и консоль - в отдельном потоке)
+setup_logging()
 logger = logging.getLogger("VK_Bot")
+# Логгеры компонентов; уровень каждого задается через LOG_LEVELS
+members_logger = logging.getLogger("VK_Bot.members")
+invite_logger = logging.getLogger("VK_Bot.invite")
+
+# Максимальное количество пользователей в одном запросе groups.isMember
+MEMBERSHIP_BATCH_SIZE = 500
+
+# Максимальное количество вызовов API в одном запросе execute
+EXECUTE_MAX_CALLS = 25
+
+# Количество повторных запросов страницы участников после временной ошибки
+PAGE_RETRY_ATTEMPTS = 3
+
+# Базовая задержка перед повторным запросом страницы, секунды
+PAGE_RETRY_DELAY = 5
+
+# Результаты обработки пользователей с коротким сроком действия
+# (остальные - privacy, member, error - хранятся outcome_ttl["permanent"])
+TRANSIENT_OUTCOMES = ("transient",)
+
+# Максимальное количество пользователей в одном запросе users.get
+USERS_GET_BATCH_SIZE = 1000
+
+# Количество участников в одной странице groups.getMembers
+MEMBERS_PAGE_SIZE = 1000
+
+# Время, в течение которого сохраненная страница участников считается актуальной
+MEMBER_PAGE_TTL = timedelta(days=1)
+
+# Во сколько раз подходящих пользователей должно быть просмотрено больше,
+# чем будет приглашено за запуск (для случайной выборки)
+CANDIDATE_POOL_FACTOR = 5
+
+# Время жизни сохраненного в файле состояния числового ID группы
+GROUP_ID_CACHE_TTL = timedelta(days=7)
+
+# Кэш числовых ID групп на время жизни процесса (сохраняется между циклами)
+_group_id_cache = {}
+
+# Метрики на время жизни процесса (сохраняются между циклами)
+_metrics = Metrics()
+
+# HTTP-сессия на время жизни процесса (сохраняется между циклами)
+_http_session = None
+
+def get_http_session(config):
+    """Общая для всех циклов HTTP-сессия с пулом соединений"""
+    global _http_session
+    if _http_session is None:
+        _http_session = create_session(config)
+    return _http_session
 
 class VKInviteBot:
-    def __init__(self):
-        """Инициализация бота с параметрами из переменных окружения"""
+    def __init__(self, session=None):
+        """Инициализация бота с параметрами из переменных окружения
+        
+        session - HTTP-сессия для запросов к API; по умолчанию используется
+        общая для процесса сессия с пулом соединений (см. vk_transport.py).
+        """
         self.load_config()
+        self.metrics = _metrics
         
         # Авторизация в ВК
         try:
-            self.vk_session = vk_api.VkApi(token=self.config["access_token"])
-            self.vk = self.vk_session.get_api()
+            self.http_session = session or get_http_session(self.config)
+            self.vk_session = vk_api.VkApi(token=self.config["access_token"], session=self.http_session)
+            self.vk = InstrumentedApi(self.vk_session.get_api(), self.metrics)
             logger.info("Успешная авторизация в VK API")
         except Exception as e:
             logger.error(f"Ошибка авторизации: {e}")
@@ -42,6 +101,9 @@ class VKInviteBot:
         self.stats_file = "stats.json"
         self.load_stats()
         
+        # Однократное получение числовых ID групп
+        self.resolve_group_ids()
+        
     def load_config(self):
         """Загрузка настроек из переменных окружения"""
         try:
@@ -67,6 +129,27 @@ class VKInviteBot:
                 "target_group_id": os.getenv("TARGET_GROUP_ID"),  # Оставляем строку для обработки
                 "your_group_id": os.getenv("YOUR_GROUP_ID"),      # Оставляем строку для обработки
                 "max_invites_per_day": safe_int(os.getenv("MAX_INVITES_PER_DAY"), 20),
+                "max_members_per_run": safe_int(os.getenv("MAX_MEMBERS_PER_RUN", "5000"), 5000),
+                "state_backend": os.getenv("STATE_BACKEND", "json").lower(),  # json или sqlite
+                "state_db_file": os.getenv("STATE_DB_FILE", "stats.db"),
+                "members_cache_dir": os.getenv("MEMBERS_CACHE_DIR", "members_cache"),
+                "use_execute": os.getenv("USE_EXECUTE", "False").lower() == "true",  # Объединение запросов через execute
+                "lazy_profile_fields": os.getenv("LAZY_PROFILE_FIELDS", "False").lower() == "true",  # Поля профиля только для кандидатов
+                "outcome_ttl": {
+                    # Ограничения приватности, участие в группе, прочие ошибки VK
+                    "permanent": timedelta(days=safe_int(os.getenv("OUTCOME_PERMANENT_TTL_DAYS", "90"), 90)),
+                    # Сбои сети и сервера VK, превышение лимитов запросов
+                    "transient": timedelta(hours=safe_int(os.getenv("OUTCOME_TRANSIENT_TTL_HOURS", "12"), 12))
+                },
+                "metrics": {
+                    "host": os.getenv("METRICS_HOST", "127.0.0.1"),
+                    "port": safe_int(os.getenv("METRICS_PORT", "0"), 0)  # 0 - HTTP-сервер метрик отключен
+                },
+                "transport": {
+                    "api_url": os.getenv("VK_API_URL", VK_API_URL),  # Адрес API (например, локального fake_vk_server.py)
+                    "connect_timeout": safe_int(os.getenv("VK_CONNECT_TIMEOUT", "5"), 5),
+                    "read_timeout": safe_int(os.getenv("VK_READ_TIMEOUT", "30"), 30)
+                },
                 "delay_between_invites": {     
                     "min": safe_int(os.getenv("MIN_DELAY"), 120),   # Умеренная задержка (2 минуты)
                     "max": safe_int(os.getenv("MAX_DELAY"), 240)    # Умеренная задержка (4 минуты)
@@ -115,6 +198,24 @@ class VKInviteBot:
             logger.error(traceback.format_exc())
             exit(1)
     
+    def sleep(self, seconds, reason):
+        """Пауза с учетом времени ожидания в метриках (reason - причина паузы)"""
+        self.metrics.observe_sleep(reason, seconds)
+        time.sleep(seconds)
+    
+    def execute_calls(self, calls):
+        """Выполнение нескольких методов API одним запросом execute.
+        
+        calls - список пар (метод, параметры), не более EXECUTE_MAX_CALLS.
+        Возвращает список результатов в том же порядке; для вызовов,
+        завершившихся ошибкой, VK возвращает False.
+        """
+        code = "return [%s];" % ",".join(
+            "API.%s(%s)" % (method, json.dumps(params, ensure_ascii=False))
+            for method, params in calls
+        )
+        return self.vk.execute(code=code)
+    
     def get_group_id(self, group_identifier):
         """Получение числового ID группы по короткому имени или строковому ID"""
         try:
@@ -124,13 +225,19 @@ class VKInviteBot:
             except (ValueError, TypeError):
                 pass
                 
+            cached = self.get_cached_group_id(group_identifier)
+            if cached is not None:
+                return cached
+                
             # Небольшая задержка перед API запросом
-            time.sleep(1)
+            self.sleep(1, "group_id")
             
             # Пытаемся получить ID по короткому имени
             response = self.vk.groups.getById(group_id=group_identifier)
             if response and len(response) > 0:
-                return response[0]['id']
+                group_id = response[0]['id']
+                self.cache_group_id(group_identifier, group_id)
+                return group_id
                 
             logger.warning(f"Не удалось получить ID группы для '{group_identifier}', используется как есть")
             return group_identifier
@@ -139,50 +246,129 @@ class VKInviteBot:
             logger.error(f"Ошибка получения ID группы: {e}")
             return group_identifier
     
+    def get_cached_group_id(self, group_identifier):
+        """Числовой ID группы из кэша процесса или файла состояния (или None)"""
+        # ID уже получен в этом процессе
+        if group_identifier in _group_id_cache:
+            return _group_id_cache[group_identifier]
+            
+        # ID сохранен в файле состояния и еще не устарел
+        cached = self.stats.get("group_cache", {}).get(group_identifier)
+        if cached:
+            resolved_at = datetime.fromisoformat(cached["resolved_at"])
+            if datetime.now() - resolved_at < GROUP_ID_CACHE_TTL:
+                _group_id_cache[group_identifier] = cached["id"]
+                return cached["id"]
+                
+        return None
+    
+    def cache_group_id(self, group_identifier, group_id):
+        """Сохранение числового ID группы в кэше процесса и в файле состояния"""
+        _group_id_cache[group_identifier] = group_id
+        group_cache = dict(self.stats.get("group_cache", {}))
+        group_cache[group_identifier] = {
+            "id": group_id,
+            "resolved_at": datetime.now().isoformat()
+        }
+        self.update_stats({"group_cache": group_cache})
+    
+    def resolve_group_ids(self):
+        """Получение числовых ID целевой и нашей группы при загрузке конфигурации"""
+        keys = ("target_group_id", "your_group_id")
+        
+        # Несколько коротких имен получаем одним запросом execute
+        pending = []
+        for key in keys:
+            identifier = self.config[key]
+            if (isinstance(identifier, str) and not identifier.isdigit()
+                    and identifier not in pending and self.get_cached_group_id(identifier) is None):
+                pending.append(identifier)
+                
+        if self.config["use_execute"] and len(pending) > 1:
+            try:
+                self.sleep(1, "group_id")
+                responses = self.execute_calls([
+                    ("groups.getById", {"group_id": identifier}) for identifier in pending
+                ])
+                for identifier, response in zip(pending, responses):
+                    if response:
+                        self.cache_group_id(identifier, response[0]["id"])
+            except Exception as e:
+                logger.error(f"Ошибка получения ID групп через execute: {e}")
+        
+        for key in keys:
+            group_id = self.get_group_id(self.config[key])
+            logger.info(f"ID группы {self.config[key]}: {group_id}")
+    
     def load_stats(self):
         """Загрузка статистики и состояния бота"""
         try:
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, 'r', encoding='utf-8') as f:
-                    self.stats = json.load(f)
-            else:
-                self.stats = {
-                    "total_invites_sent": 0,
-                    "invites_today": 0,
-                    "last_invite_date": None,
-                    "processed_users": [],
-                    "users_with_privacy_restrictions": [],
-                    "last_activity_time": None
-                }
-                self.save_stats()
-                
-            # Проверка наличия поля для пользователей с ограничениями приватности
-            if "users_with_privacy_restrictions" not in self.stats:
-                self.stats["users_with_privacy_restrictions"] = []
-                self.save_stats()
-                
+            self.state_store = create_state_store(
+                self.config["state_backend"], self.stats_file, self.config["state_db_file"]
+            )
+            self.stats = self.state_store.load()
+            
+            # Удаляем результаты обработки пользователей с истекшим сроком
+            max_ttl = max(self.config["outcome_ttl"].values())
+            self.stats["user_outcomes"].prune(int(time.time() - max_ttl.total_seconds()))
         except Exception as e:
             logger.error(f"Ошибка загрузки статистики: {e}")
-            self.stats = {
-                "total_invites_sent": 0,
-                "invites_today": 0,
-                "last_invite_date": None,
-                "processed_users": [],
-                "users_with_privacy_restrictions": [],
-                "last_activity_time": None
-            }
+            self.stats = default_stats()
     
     def save_stats(self):
-        """Сохранение статистики и состояния бота"""
+        """Сохранение полного снимка статистики и состояния бота"""
         try:
             # Обновляем время последней активности
             self.stats["last_activity_time"] = datetime.now().isoformat()
-            
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, indent=4, ensure_ascii=False)
+            self.state_store.save(self.stats)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения статистики: {e}")
+    
+    def update_stats(self, values=None, users=None, outcomes=None):
+        """Изменение статистики с дозаписью в журнал состояния
+        
+        values - словарь новых значений полей, users - словарь
+        {поле: список ID} для добавления в множества пользователей,
+        outcomes - словарь {ID: результат обработки пользователя}.
+        """
+        values = dict(values or {})
+        # Обновляем время последней активности
+        values["last_activity_time"] = datetime.now().isoformat()
+        try:
+            self.state_store.record(self.stats, values, users, outcomes)
         except Exception as e:
             logger.error(f"Ошибка сохранения статистики: {e}")
     
+    def get_outcome(self, user_id):
+        """Сохраненный результат обработки пользователя, если он не устарел"""
+        item = self.stats["user_outcomes"].get(user_id)
+        if item is None:
+            return None
+        outcome, recorded_at = item
+        ttl = self.config["outcome_ttl"]["transient" if outcome in TRANSIENT_OUTCOMES else "permanent"]
+        if time.time() - recorded_at >= ttl.total_seconds():
+            return None
+        return outcome
+    
+    def is_known_user(self, user_id):
+        """Пользователь уже обработан или его недавно не удалось пригласить.
+        
+        Ограничения приватности, записанные до появления user_outcomes,
+        хранилище состояния переносит в processed_users при загрузке.
+        """
+        if user_id in self.stats["processed_users"]:
+            return True
+        return self.get_outcome(user_id) is not None
+    
+    def invites_left(self):
+        """Количество приглашений, которое еще можно отправить сегодня"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        last_date = self.stats["last_invite_date"]
+        
+        # Счетчик за прошлый день будет сброшен в начале цикла
+        invites_today = 0 if last_date and last_date != today else self.stats["invites_today"]
+        return max(self.config["max_invites_per_day"] - invites_today, 0)
+    
     def reset_daily_counter(self):
         """Сброс дневного счетчика приглашений"""
         today = datetime.now().strftime("%Y-%m-%d")
@@ -190,145 +376,330 @@ class VKInviteBot:
         
         if last_date and last_date != today:
             logger.info("Сброс дневного счетчика приглашений")
-            self.stats["invites_today"] = 0
-            self.save_stats()
+            self.update_stats({"invites_today": 0})
     
     def get_group_members(self, group_id, count=1000):
-        """Получение списка участников группы"""
+        """Постраничное получение участников группы.
+        
+        Генератор: страницы отдаются по мере получения, чтобы обработка
+        могла остановиться, как только найдено достаточно кандидатов.
+        Обход продолжается с сохраненного курсора и идет по кругу;
+        страницы из локальной копии, которые еще не устарели, повторно
+        не запрашиваются.
+        """
         try:
             # Получаем числовой ID группы, если передано короткое имя
             actual_group_id = self.get_group_id(group_id)
-            logger.info(f"Получение участников группы: {group_id} (ID: {actual_group_id})")
+            members_logger.info(f"Получение участников группы: {group_id} (ID: {actual_group_id})")
+            
+            # Запрашиваем только поля профиля, нужные включенным фильтрам
+            fields = self.page_fields()
             
-            members = []
-            offset = 0
+            snapshot = MemberSnapshot(self.config["members_cache_dir"], actual_group_id)
+            start_offset = snapshot.cursor
+            offset = start_offset
+            total = snapshot.count
+            wrapped = False
+            fetched = 0
+            requested = False
+            
+            members_logger.info(f"Обход участников начинается со смещения {start_offset}")
             
             while True:
-                # Небольшая задержка между запросами
-                time.sleep(1)
+                batch = snapshot.get_page(offset, MEMBER_PAGE_TTL, fields)
+                skipped = False
                 
-                response = self.vk.groups.getMembers(
-                    group_id=actual_group_id,
-                    offset=offset,
-                    count=1000,
-                    fields="sex,bdate,city,last_seen,has_photo"
-                )
+                if batch is None:
+                    # Задержка между запросами для соблюдения ограничений API
+                    if requested:
+                        self.sleep(2, "members_page")
+                    
+                    # Небольшая задержка между запросами
+                    self.sleep(1, "members_page")
+                    
+                    # С execute за один запрос получаем и следующие страницы,
+                    # которые понадобятся в этом запуске
+                    offsets = [offset]
+                    if self.config["use_execute"]:
+                        pages_left = -(-(count - fetched) // MEMBERS_PAGE_SIZE)
+                        for next_offset in range(
+                            offset + MEMBERS_PAGE_SIZE,
+                            offset + min(pages_left, EXECUTE_MAX_CALLS) * MEMBERS_PAGE_SIZE,
+                            MEMBERS_PAGE_SIZE
+                        ):
+                            if total is not None and next_offset >= total:
+                                break
+                            if wrapped and next_offset >= start_offset:
+                                break
+                            if snapshot.get_page(next_offset, MEMBER_PAGE_TTL, fields) is None:
+                                offsets.append(next_offset)
+                    
+                    try:
+                        responses = self.fetch_member_pages(actual_group_id, offsets, fields)
+                    except Exception as e:
+                        if classify_error(e) not in RETRYABLE_ERRORS:
+                            raise
+                        members_logger.warning(f"Временная ошибка получения страницы участников со смещением {offset}: {e}")
+                        responses = [False] * len(offsets)
+                    requested = True
+                    
+                    for page_offset, response in zip(offsets, responses):
+                        if response is not False:
+                            snapshot.put_page(page_offset, response["items"], fields)
+                    
+                    # Неполученная страница запрашивается повторно отдельно,
+                    # остальные страницы запуска при этом сохраняются
+                    response = responses[0]
+                    if response is False:
+                        response = self.retry_member_page(actual_group_id, offset, fields)
+                        if response is not None:
+                            snapshot.put_page(offset, response["items"], fields)
+                            
+                    if response is not None:
+                        batch = response["items"]
+                        total = response["count"]
+                    elif total is not None:
+                        # Страница не получена после всех попыток - пропускаем
+                        # ее и продолжаем обход со следующей
+                        members_logger.error(f"Страница участников со смещением {offset} пропущена после {PAGE_RETRY_ATTEMPTS} попыток")
+                        batch = []
+                        skipped = True
+                    else:
+                        # Без известного количества участников конец группы не определить
+                        raise Exception(f"Не удалось получить страницу участников со смещением {offset}")
+                    
+                # Курсор указывает на страницу, обработка которой начата
+                snapshot.set_cursor(offset, total)
                 
-                batch = response["items"]
-                if not batch:
-                    break
+                if batch:
+                    fetched += len(batch)
+                    yield batch
                     
-                members.extend(batch)
-                offset += 1000
+                offset += MEMBERS_PAGE_SIZE
                 
-                if offset >= count:
-                    break
+                # Дошли до конца группы - продолжаем с начала до стартовой страницы
+                if (not batch and not skipped) or (total is not None and offset >= total):
+                    if wrapped or start_offset == 0:
+                        snapshot.set_cursor(0, total)
+                        break
+                    offset = 0
+                    wrapped = True
                     
-                # Задержка между запросами для соблюдения ограничений API
-                time.sleep(2)
+                if (wrapped and offset >= start_offset) or fetched >= count:
+                    break
                 
-            logger.info(f"Получено {len(members)} участников из группы {group_id}")
-            
-            # Перемешиваем список пользователей для более естественного поведения
-            random.shuffle(members)
-            
-            return members
         except Exception as e:
-            logger.error(f"Ошибка получения участников группы: {e}")
+            members_logger.error(f"Ошибка получения участников группы: {e}")
             
-            # Если получили ошибку, сделаем паузу и попробуем снова
-            if "captcha" in str(e).lower():
-                logger.warning("Обнаружена капча, делаем паузу в 15 минут...")
-                time.sleep(900)  # 15 минут
+            # Если получили ошибку, сделаем паузу
+            if classify_error(e) == "captcha":
+                members_logger.warning("Обнаружена капча, делаем паузу в 15 минут...")
+                self.sleep(900, "captcha")  # 15 минут
             
             import traceback
-            logger.error(traceback.format_exc())
-            return []
+            members_logger.error(traceback.format_exc())
     
-    def filter_users(self, users):
-        """Фильтрация пользователей согласно настройкам"""
-        filtered_users = []
-        filters = self.config["filters"]
+    def retry_member_page(self, group_id, offset, fields):
+        """Повторный запрос одной страницы участников после временной ошибки.
         
-        for user in users:
-            # Пропускаем уже обработанных пользователей
-            if user["id"] in self.stats["processed_users"]:
+        Делает до PAGE_RETRY_ATTEMPTS попыток с растущей задержкой и
+        возвращает None, если все они не удались. Ошибки, которые не имеет
+        смысла повторять (например, капча), передаются вызывающему.
+        """
+        for attempt in range(1, PAGE_RETRY_ATTEMPTS + 1):
+            self.sleep(PAGE_RETRY_DELAY * attempt, "members_retry")
+            try:
+                response = self.fetch_member_pages(group_id, [offset], fields)[0]
+            except Exception as e:
+                if classify_error(e) not in RETRYABLE_ERRORS:
+                    raise
+                members_logger.warning(f"Попытка {attempt} получить страницу участников со смещением {offset} не удалась: {e}")
                 continue
+            if response is not False:
+                return response
+        return None
+    
+    def page_fields(self):
+        """Поля профиля, запрашиваемые вместе со страницами участников.
+        
+        При LAZY_PROFILE_FIELDS страницы запрашиваются без полей (только ID),
+        а поля получаются в filter_users для оставшихся кандидатов.
+        """
+        if self.config["lazy_profile_fields"]:
+            return []
+        return member_fields(self.config["filters"])
+    
+    def fetch_member_pages(self, group_id, offsets, fields):
+        """Получение страниц участников группы по списку смещений.
+        
+        Одна страница запрашивается обычным вызовом groups.getMembers,
+        несколько - одним запросом execute. Без полей VK возвращает только
+        ID, они приводятся к виду {"id": ...}.
+        """
+        params = {"group_id": group_id, "count": MEMBERS_PAGE_SIZE}
+        if fields:
+            params["fields"] = ",".join(fields)
+            
+        calls = [("groups.getMembers", dict(params, offset=offset)) for offset in offsets]
+        if len(calls) == 1:
+            responses = [self.vk.groups.getMembers(**calls[0][1])]
+        else:
+            responses = self.execute_calls(calls)
+            
+        for response in responses:
+            if response is not False and not fields:
+                response["items"] = [{"id": user_id} for user_id in response["items"]]
+        return responses
+    
+    def get_profiles(self, user_ids, fields):
+        """Получение полей профиля для списка пользователей через users.get"""
+        profiles = []
+        for start in range(0, len(user_ids), USERS_GET_BATCH_SIZE):
+            batch = user_ids[start:start + USERS_GET_BATCH_SIZE]
+            try:
+                self.sleep(0.5, "profiles")  # Небольшая задержка
                 
-            # Пропускаем пользователей с известными ограничениями приватности
-            if user["id"] in self.stats["users_with_privacy_restrictions"]:
-                continue
+                profiles.extend(self.vk.users.get(
+                    user_ids=",".join(str(user_id) for user_id in batch),
+                    fields=",".join(fields)
+                ))
+            except Exception as e:
+                if classify_error(e) == "captcha":
+                    members_logger.warning("Обнаружена капча при получении профилей, делаем паузу в 10 минут...")
+                    self.sleep(600, "captcha")  # 10 минут
+                # При ошибке пропускаем всю пачку пользователей
+                members_logger.error(f"Ошибка получения профилей для {len(batch)} пользователей: {e}")
                 
-            # Проверка, не является ли пользователь уже участником нашей группы
+        return profiles
+    
+    def select_candidates(self, quota):
+        """Отбор случайных подходящих пользователей для приглашения.
+        
+        Страницы участников целевой группы фильтруются по мере получения.
+        Из подходящих пользователей выборкой с резервуаром сохраняется не
+        более quota случайных; получение страниц прекращается, когда
+        просмотрено CANDIDATE_POOL_FACTOR * quota подходящих пользователей.
+        """
+        reservoir = []
+        eligible = 0
+        members = 0
+        
+        for page in self.get_group_members(
+            self.config["target_group_id"], count=self.config["max_members_per_run"]
+        ):
+            members += len(page)
+            for user in self.filter_users(page):
+                eligible += 1
+                if len(reservoir) < quota:
+                    reservoir.append(user)
+                else:
+                    index = random.randrange(eligible)
+                    if index < quota:
+                        reservoir[index] = user
+                        
+            if eligible >= quota * CANDIDATE_POOL_FACTOR:
+                break
+                
+        members_logger.info(f"Просмотрено {members} участников, подходящих: {eligible}, выбрано: {len(reservoir)}")
+        
+        # Перемешиваем выбранных пользователей для более естественного поведения
+        random.shuffle(reservoir)
+        return reservoir, members
+    
+    def check_membership(self, user_ids):
+        """Пакетная проверка участия пользователей в нашей группе.
+
+        Возвращает словарь {user_id: является_ли_участником}. Пользователи,
+        для которых проверка не удалась, в словарь не попадают.
+        """
+        membership = {}
+        if not user_ids:
+            return membership
+            
+        actual_group_id = self.get_group_id(self.config["your_group_id"])
+        
+        batches = [
+            user_ids[start:start + MEMBERSHIP_BATCH_SIZE]
+            for start in range(0, len(user_ids), MEMBERSHIP_BATCH_SIZE)
+        ]
+        
+        # С execute несколько пачек проверяются одним запросом
+        per_request = EXECUTE_MAX_CALLS if self.config["use_execute"] else 1
+        
+        for start in range(0, len(batches), per_request):
+            chunk = batches[start:start + per_request]
             try:
-                time.sleep(0.5)  # Небольшая задержка
+                self.sleep(0.5, "membership")  # Небольшая задержка
                 
-                actual_group_id = self.get_group_id(self.config["your_group_id"])
-                is_member = self.vk.groups.isMember(
-                    group_id=actual_group_id,
-                    user_id=user["id"]
-                )
+                calls = [
+                    ("groups.isMember", {
+                        "group_id": actual_group_id,
+                        "user_ids": ",".join(str(user_id) for user_id in batch)
+                    })
+                    for batch in chunk
+                ]
+                if len(calls) == 1:
+                    responses = [self.vk.groups.isMember(**calls[0][1])]
+                else:
+                    responses = self.execute_calls(calls)
                 
-                if is_member:
-                    continue
+                for batch, response in zip(chunk, responses):
+                    if response is False:
+                        members_logger.error(f"Ошибка проверки участия для {len(batch)} пользователей в execute")
+                        continue
+                    for item in response:
+                        membership[item["user_id"]] = bool(item["member"])
             except Exception as e:
-                if "captcha" in str(e).lower():
-                    logger.warning("Обнаружена капча при проверке участия, делаем паузу в 10 минут...")
-                    time.sleep(600)  # 10 минут
-                # При ошибке пропускаем пользователя
-                continue
+                if classify_error(e) == "captcha":
+                    members_logger.warning("Обнаружена капча при проверке участия, делаем паузу в 10 минут...")
+                    self.sleep(600, "captcha")  # 10 минут
+                # При ошибке пропускаем всю пачку пользователей
+                members_logger.error(f"Ошибка проверки участия для {sum(len(batch) for batch in chunk)} пользователей: {e}")
                 
-            is_suitable = True
-            
-            # Фильтр по последней активности
-            if filters["last_seen_days"]["enabled"] and "last_seen" in user:
-                last_seen_time = user["last_seen"]["time"]
-                last_seen_date = datetime.fromtimestamp(last_seen_time)
-                days_ago = (datetime.now() - last_seen_date).days
+        return membership
+    
+    def filter_users(self, users):
+        """Фильтрация пользователей согласно настройкам"""
+        filters = self.config["filters"]
+        
+        # Пропускаем уже обработанных пользователей и пользователей
+        # с действующим результатом обработки (ограничения приватности,
+        # участие в группе, недавние ошибки)
+        new_users = [user for user in users if not self.is_known_user(user["id"])]
+        
+        # Поля профиля, не запрошенные вместе со страницей, получаем
+        # только для оставшихся пользователей
+        lazy_fields = [field for field in member_fields(filters) if field not in self.page_fields()]
+        if lazy_fields and new_users:
+            new_users = self.get_profiles([user["id"] for user in new_users], lazy_fields)
+        
+        # Все фильтры профиля применяются к странице целиком
+        mask = filter_mask(MemberColumns(new_users), filters)
+        candidates = [user for user, is_suitable in zip(new_users, mask) if is_suitable]
                 
-                if days_ago > filters["last_seen_days"]["value"]:
-                    is_suitable = False
-                    
-            # Фильтр по полу
-            if filters["sex"]["enabled"] and filters["sex"]["value"] != 0:
-                if "sex" not in user or user["sex"] != filters["sex"]["value"]:
-                    is_suitable = False
-                    
-            # Фильтр по городу
-            if filters["city_id"]["enabled"]:
-                if "city" not in user or user["city"]["id"] != filters["city_id"]["value"]:
-                    is_suitable = False
-                    
-            # Фильтр по наличию фото
-            if filters["has_photo"]["enabled"]:
-                if "has_photo" not in user or user["has_photo"] != 1:
-                    is_suitable = False
-                    
-            # Фильтр по возрасту (если указана дата рождения)
-            if filters["age"]["enabled"] and "bdate" in user:
-                try:
-                    bdate = user["bdate"]
-                    if len(bdate.split(".")) == 3:  # Формат DD.MM.YYYY
-                        birth_date = datetime.strptime(bdate, "%d.%m.%Y")
-                        age = (datetime.now() - birth_date).days // 365
-                        
-                        if age < filters["age"]["min"] or age > filters["age"]["max"]:
-                            is_suitable = False
-                except:
-                    # При ошибке парсинга даты рождения пропускаем этот фильтр
-                    pass
-                    
-            if is_suitable:
-                filtered_users.append(user)
+        # Проверка, не являются ли кандидаты уже участниками нашей группы.
+        # Выполняется после локальных фильтров, чтобы не тратить запросы к API
+        # на заведомо неподходящих пользователей
+        membership = self.check_membership([user["id"] for user in candidates])
+        
+        # Участники нашей группы не проверяются повторно до истечения срока
+        members = {user_id: "member" for user_id, is_member in membership.items() if is_member}
+        if members:
+            self.update_stats(outcomes=members)
+        
+        filtered_users = [
+            user for user in candidates
+            if membership.get(user["id"]) is False
+        ]
                 
-        logger.info(f"Отфильтровано {len(filtered_users)} подходящих пользователей из {len(users)}")
+        members_logger.info(f"Отфильтровано {len(filtered_users)} подходящих пользователей из {len(users)}")
         return filtered_users
     
     def invite_user(self, user_id):
         """Отправка приглашения пользователю"""
         try:
             # Небольшая задержка перед приглашением
-            time.sleep(random.uniform(1, 3))
+            self.sleep(random.uniform(1, 3), "invite")
             
             actual_group_id = self.get_group_id(self.config["your_group_id"])
             result = self.vk.groups.invite(
@@ -338,68 +709,117 @@ class VKInviteBot:
             
             # Обновление статистики
             today = datetime.now().strftime("%Y-%m-%d")
-            self.stats["total_invites_sent"] += 1
-            self.stats["invites_today"] += 1
-            self.stats["last_invite_date"] = today
-            self.stats["processed_users"].append(user_id)
-            self.save_stats()
+            self.update_stats(
+                {
+                    "total_invites_sent": self.stats["total_invites_sent"] + 1,
+                    "invites_today": self.stats["invites_today"] + 1,
+                    "last_invite_date": today
+                },
+                {"processed_users": [user_id]}
+            )
             
-            logger.info(f"Успешно отправлено приглашение пользователю ID{user_id}")
+            invite_logger.info(f"Успешно отправлено приглашение пользователю ID{user_id}")
             return True
         except Exception as e:
-            error_msg = str(e).lower()
+            error_class = classify_error(e)
             
-            if "captcha" in error_msg:
-                logger.warning(f"Капча при отправке приглашения пользователю ID{user_id}. Делаем паузу...")
+            if error_class == "captcha":
+                invite_logger.warning(f"Капча при отправке приглашения пользователю ID{user_id}. Делаем паузу...")
                 # Пауза при обнаружении капчи
-                time.sleep(900)  # 15 минут
-            elif "permission to add" in error_msg or "can't add this user" in error_msg or "user disabled invites" in error_msg or "access denied" in error_msg:
+                self.sleep(900, "captcha")  # 15 минут
+            elif error_class == "privacy":
                 # Пользователь ограничил возможность приглашения в группы
-                logger.info(f"Пользователь ID{user_id} ограничил возможность приглашения в группы")
-                # Добавляем его в список пользователей с ограничениями приватности
-                self.stats["users_with_privacy_restrictions"].append(user_id)
-                self.stats["processed_users"].append(user_id)
-                self.save_stats()
-            else:
-                logger.error(f"Ошибка при отправке приглашения пользователю ID{user_id}: {e}")
+                invite_logger.info(f"Пользователь ID{user_id} ограничил возможность приглашения в группы")
+                # Добавляем его в список пользователей с ограничениями приватности;
+                # повторная попытка - после истечения outcome_ttl["permanent"]
+                self.update_stats(
+                    users={"users_with_privacy_restrictions": [user_id]},
+                    outcomes={user_id: "privacy"}
+                )
+            elif error_class == "gone":
+                invite_logger.info(f"Пользователь ID{user_id} удален или заблокирован")
                 # Добавляем в обработанные, чтобы не пытаться снова
-                self.stats["processed_users"].append(user_id)
-                self.save_stats()
+                self.update_stats(users={"processed_users": [user_id]})
+            elif error_class in RETRYABLE_ERRORS:
+                invite_logger.error(f"Временная ошибка при отправке приглашения пользователю ID{user_id}: {e}")
+                # Повторная попытка - после истечения outcome_ttl["transient"]
+                self.update_stats(outcomes={user_id: "transient"})
+            else:
+                invite_logger.error(f"Ошибка при отправке приглашения пользователю ID{user_id}: {e}")
+                self.update_stats(outcomes={user_id: "error"})
                 
             return False
     
     def run(self):
         """Основная функция работы бота"""
+        start = time.perf_counter()
+        try:
+            self.run_cycle()
+        finally:
+            self.metrics.observe_run(time.perf_counter() - start)
+            
+            # Сохраняем метрики в файле состояния
+            self.update_stats({"metrics": self.metrics.snapshot()})
+            
+            # Сворачиваем журнал изменений в снимок состояния
+            self.save_stats()
+    
+    def run_cycle(self):
+        """Один цикл приглашений"""
         logger.info("Запуск бота для приглашения пользователей")
         
         # Сброс дневного счетчика при необходимости
         self.reset_daily_counter()
         
-        # Проверка лимита на сегодня
-        if self.stats["invites_today"] >= self.config["max_invites_per_day"]:
+        # Проверка лимита на сегодня. Незавершенный цикл сохраняется и
+        # продолжается в первый запуск после сброса счетчика
+        invites_left = self.invites_left()
+        if not invites_left:
             logger.warning(f"Достигнут дневной лимит приглашений ({self.config['max_invites_per_day']}). Бот будет остановлен.")
             return
-            
-        # Получение участников целевой группы
-        target_users = self.get_group_members(self.config["target_group_id"])
-        
-        if not target_users:
-            logger.error("Не удалось получить пользователей целевой группы. Проверьте ID группы.")
-            return
-            
-        # Фильтрация подходящих пользователей
-        filtered_users = self.filter_users(target_users)
-        
-        if not filtered_users:
-            logger.warning("Не найдено подходящих пользователей для приглашения.")
-            return
-        
-        # Отправка приглашений с учетом лимитов
-        invites_left = self.config["max_invites_per_day"] - self.stats["invites_today"]
         
         # Ограничение для одного запуска
         max_batch = min(invites_left, 10)  # Максимум 10 приглашений за один запуск
-        invites_count = min(len(filtered_users), max_batch)
+        
+        # Незавершенный цикл, прерванный перезапуском, продолжаем с того же места
+        cycle = self.stats.get("current_cycle")
+        if cycle:
+            # Приглашение могло быть записано в состояние до того, как
+            # обновился план цикла: таких пользователей повторно не приглашаем
+            pending = cycle["user_ids"][cycle["done"]:]
+            unknown = [user_id for user_id in pending if not self.is_known_user(user_id)]
+            if len(unknown) < len(pending):
+                logger.info(f"Пропущено уже обработанных пользователей из прерванного цикла: {len(pending) - len(unknown)}")
+                cycle = dict(cycle, user_ids=cycle["user_ids"][:cycle["done"]] + unknown)
+                self.update_stats({"current_cycle": cycle if unknown else None})
+            if not unknown:
+                cycle = None
+        if cycle:
+            logger.info(f"Продолжение прерванного цикла: отправлено {cycle['done']} из {len(cycle['user_ids'])} приглашений")
+        else:
+            # Получение и фильтрация участников целевой группы
+            filtered_users, members_count = self.select_candidates(max_batch)
+            
+            if not members_count:
+                logger.error("Не удалось получить пользователей целевой группы. Проверьте ID группы.")
+                return
+                
+            if not filtered_users:
+                logger.warning("Не найдено подходящих пользователей для приглашения.")
+                return
+            
+            invites_count = min(len(filtered_users), max_batch)
+            
+            # Сохраняем план цикла, чтобы продолжить его после перезапуска
+            cycle = {
+                "user_ids": [user["id"] for user in filtered_users[:invites_count]],
+                "done": 0,
+                "next_invite_at": None
+            }
+            self.update_stats({"current_cycle": cycle})
+        
+        user_ids = cycle["user_ids"][cycle["done"]:][:max_batch]
+        invites_count = len(user_ids)
         
         logger.info(f"Планируется отправить {invites_count} приглашений")
         
@@ -408,32 +828,52 @@ class VKInviteBot:
         privacy_restricted_count = 0
         error_count = 0
         
-        for i in range(invites_count):
-            user = filtered_users[i]
+        for i, user_id in enumerate(user_ids):
+            # Досыпаем задержку, начатую до перезапуска
+            if i == 0 and cycle["next_invite_at"]:
+                remaining = (datetime.fromisoformat(cycle["next_invite_at"]) - datetime.now()).total_seconds()
+                if remaining > 0:
+                    logger.info(f"Ожидание {remaining:.0f} секунд перед следующим приглашением (продолжение)...")
+                    self.sleep(remaining, "invite_delay")
             
             # Отправка приглашения
             try:
-                result = self.invite_user(user["id"])
+                result = self.invite_user(user_id)
                 if result:
                     success_count += 1
                 else:
                     # Проверка, не был ли пользователь добавлен в список с ограничениями приватности
-                    if user["id"] in self.stats["users_with_privacy_restrictions"]:
+                    if self.get_outcome(user_id) == "privacy":
                         privacy_restricted_count += 1
                     else:
                         error_count += 1
             except Exception as e:
-                logger.error(f"Непредвиденная ошибка при обработке пользователя ID{user['id']}: {e}")
+                logger.error(f"Непредвиденная ошибка при обработке пользователя ID{user_id}: {e}")
                 error_count += 1
             
             # Задержка между приглашениями
+            delay = None
             if i < invites_count - 1:
                 delay = random.randint(
                     self.config["delay_between_invites"]["min"],
                     self.config["delay_between_invites"]["max"]
                 )
+                
+            cycle = dict(
+                cycle,
+                done=cycle["done"] + 1,
+                next_invite_at=(datetime.now() + timedelta(seconds=delay)).isoformat() if delay is not None else None
+            )
+            self.update_stats({"current_cycle": cycle})
+            
+            if delay is not None:
                 logger.info(f"Ожидание {delay} секунд ({delay/60:.1f} минут) перед следующим приглашением...")
-                time.sleep(delay)
+                self.sleep(delay, "invite_delay")
+        
+        # Цикл завершен; если дневной лимит не позволил отправить все
+        # запланированные приглашения, план сохраняется до следующего запуска
+        if cycle["done"] >= len(cycle["user_ids"]):
+            self.update_stats({"current_cycle": None})
         
         # Итоговая статистика
         logger.info(f"Успешно отправлено: {success_count} приглашений")
@@ -444,24 +884,87 @@ class VKInviteBot:
         # Сколько пользователей всего в базе с ограничениями приватности
         logger.info(f"Всего пользователей с ограничениями приватности в базе: {len(self.stats['users_with_privacy_restrictions'])}")
 
+class BotScheduler:
+    """Планировщик запусков бота на asyncio.
+    
+    Один экземпляр бота (и HTTP-сессии) живет все время работы процесса.
+    Время следующего запуска хранится в файле состояния, поэтому после
+    перезапуска контейнера расписание продолжается, а прерванный цикл
+    приглашений возобновляется (см. VKInviteBot.run_cycle). Сервер
+    метрик работает в том же цикле событий.
+    """
+    
+    def __init__(self, bot):
+        self.bot = bot
+        
+    async def serve(self):
+        """Бесконечный цикл запусков бота"""
+        metrics_config = self.bot.config["metrics"]
+        if metrics_config["port"]:
+            await serve_metrics(self.bot.metrics, metrics_config["host"], metrics_config["port"])
+            logger.info(f"Метрики доступны на http://{metrics_config['host']}:{metrics_config['port']}/metrics")
+            
+        while True:
+            await self.wait_for_next_run()
+            logger.info("Запуск нового цикла")
+            await self.run_in_thread(self.bot.run)
+            self.schedule_next_run()
+            
+    async def wait_for_next_run(self):
+        """Ожидание сохраненного времени следующего запуска"""
+        # Прерванный цикл продолжаем сразу, если дневной лимит позволяет
+        # отправить приглашения; иначе ждем запланированного запуска
+        if self.bot.stats.get("current_cycle") and self.bot.invites_left():
+            return
+            
+        next_run_at = self.bot.stats.get("next_run_at")
+        if not next_run_at:
+            return
+            
+        seconds = (datetime.fromisoformat(next_run_at) - datetime.now()).total_seconds()
+        if seconds > 0:
+            logger.info(f"Следующий запуск в {next_run_at} (через {seconds / 3600:.2f} часов)")
+            self.bot.metrics.observe_sleep("cycle_wait", seconds)
+            await asyncio.sleep(seconds)
+            
+    def schedule_next_run(self):
+        """Выбор и сохранение времени следующего запуска"""
+        # Интервал между запусками (4-6 часов)
+        sleep_hours = random.uniform(4.0, 6.0)
+        logger.info(f"Ожидание следующего запуска ({sleep_hours:.2f} часов)...")
+        next_run_at = datetime.now() + timedelta(hours=sleep_hours)
+        self.bot.update_stats({"next_run_at": next_run_at.isoformat()})
+        
+    async def run_in_thread(self, func):
+        """Выполнение блокирующей функции в фоновом потоке.
+        
+        Поток-демон не задерживает завершение процесса: состояние
+        сохраняется после каждого действия, и прерванный цикл будет
+        продолжен при следующем запуске.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        def target():
+            try:
+                result = func()
+            except BaseException as e:
+                loop.call_soon_threadsafe(future.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(future.set_result, result)
+                
+        threading.Thread(target=target, daemon=True).start()
+        return await future
+
 def main():
     """Точка входа в программу"""
     logger.info("=" * 50)
     logger.info("Запуск программы")
     
     try:
-        bot = VKInviteBot()
-        bot.run()
-        
         # Для Railway: запуск по расписанию с интервалом
-        while True:
-            # Интервал между запусками (4-6 часов)
-            sleep_hours = random.uniform(4.0, 6.0)
-            logger.info(f"Ожидание следующего запуска ({sleep_hours:.2f} часов)...")
-            time.sleep(sleep_hours * 60 * 60)
-            logger.info("Запуск нового цикла")
-            bot = VKInviteBot()
-            bot.run()
+        bot = VKInviteBot()
+        asyncio.run(BotScheduler(bot).serve())
     except KeyboardInterrupt:
         logger.info("Программа остановлена пользователем")
     except Exception as e:
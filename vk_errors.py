@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+
+import requests
+from vk_api.exceptions import ApiError, ApiHttpError, Captcha
+
+# Классы ошибок VK API по кодам ошибок
+# (https://dev.vk.com/ru/reference/errors)
+ERROR_CLASSES = {
+    1: "transient",      # Unknown error occurred
+    6: "rate_limit",     # Too many requests per second
+    7: "privacy",        # Permission to perform this action is denied
+    9: "rate_limit",     # Flood control
+    10: "transient",     # Internal server error
+    14: "captcha",       # Captcha needed
+    15: "privacy",       # Access denied (пользователь запретил приглашения)
+    18: "gone",          # User was deleted or banned
+    29: "rate_limit",    # Rate limit reached
+    30: "privacy",       # This profile is private
+    103: "rate_limit",   # Out of limits
+    113: "gone",         # Invalid user id
+}
+
+# Классы ошибок, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = ("transient", "rate_limit")
+
+
+def classify_error(error):
+    """Класс ошибки вызова API.
+
+    captcha, rate_limit, transient (сбой сети или сервера VK, в том числе
+    HTTP-ответ 5xx/429 или ответ, который не удалось разобрать), privacy
+    (ограничения приватности пользователя), gone (пользователь удален
+    или не существует) или error - прочие ошибки VK.
+    """
+    if isinstance(error, Captcha):
+        return "captcha"
+    if isinstance(error, ApiError):
+        return ERROR_CLASSES.get(error.code, "error")
+    if isinstance(error, (ApiHttpError, requests.RequestException, OSError, json.JSONDecodeError)):
+        return "transient"
+    return "error"
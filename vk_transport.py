@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import requests
+from requests.adapters import HTTPAdapter
+from vk_api.vk_api import DEFAULT_USERAGENT
+
+# Адрес методов API, который использует vk_api
+VK_API_URL = "https://api.vk.com/method/"
+
+# Размер пула HTTP-соединений
+POOL_SIZE = 4
+
+
+class VkHttpSession(requests.Session):
+    """HTTP-сессия для vk_api с пулом соединений и таймаутами.
+
+    Запросы к методам API перенаправляются на base_url, что позволяет
+    работать с локальным сервером (см. fake_vk_server.py). Сессия живет
+    все время работы процесса, поэтому соединения и TLS-рукопожатия
+    переиспользуются между циклами.
+    """
+
+    def __init__(self, base_url=VK_API_URL, connect_timeout=5, read_timeout=30):
+        super().__init__()
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.timeout = (connect_timeout, read_timeout)
+        self.headers['User-agent'] = DEFAULT_USERAGENT
+
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        if url.startswith(VK_API_URL):
+            url = self.base_url + url[len(VK_API_URL):]
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(config):
+    """Создание HTTP-сессии по настройкам config["transport"]"""
+    transport = config["transport"]
+    return VkHttpSession(
+        base_url=transport["api_url"],
+        connect_timeout=transport["connect_timeout"],
+        read_timeout=transport["read_timeout"]
+    )